@@ -42,19 +42,21 @@ import itertools as it
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import pickle as pk
 import tkinter as tk
 import tkinter.ttk as ttk
 
+import eegcache as ec
+import eegfeatures as ef
+import eegingest as ei
+import eegreader as er
+import eegtrain as et
+import eegview as ev
+
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from pstats import SortKey
-from scipy import signal, fftpack
 from sklearn.feature_selection import RFECV
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import confusion_matrix
-from sklearn.model_selection import GridSearchCV, PredefinedSplit
-from sklearn.svm import SVC
-from tkinter import N, E, W, S, filedialog, font, END, RIDGE
+from tkinter import N, E, W, S, filedialog, font, messagebox, END, RIDGE
 
 
 class EegGui:
@@ -147,6 +149,16 @@ class EegGui:
         self.selDatlbl.grid(row=0, column=0, columnspan=2, pady=5, padx=5)
         self.allLabels['Controls.TLabel'].append(self.selDatlbl)
 
+        self.banModlbl = ttk.Label(self.pagectr[0], text="Bands:", style='ControlsL.TLabel')
+        self.banModlbl.grid(row=1, column=0, sticky=E, pady=2, padx=2)
+        self.allLabels['ControlsL.TLabel'].append(self.banModlbl)
+
+        self.varBandmode = tk.StringVar()
+        self.banModmnu = ttk.OptionMenu(self.pagectr[0], self.varBandmode, ev.BANDMODES[0], *ev.BANDMODES,
+                                        style='TMenubutton')
+        self.banModmnu.grid(row=1, column=1, sticky=W)
+        self.allLabels['TMenubutton'].append(self.banModmnu)
+
         self.ploDatbtn = ttk.Button(self.pagectr[0], text="Plot Data", command=self.viewcsv)
         self.ploDatbtn.grid(row=2, column=0, columnspan=2, pady=5, padx=5)
         self.allLabels['TButton'].append(self.ploDatbtn)
@@ -212,8 +224,12 @@ class EegGui:
         self.disTimlbl.grid(row=0, column=0, pady=5, padx=5)
         self.allLabels['Display.TLabel'].append(self.disTimlbl)
 
-        self.y1 = []
+        self.view = None
         self.ys1 = None
+        self.shown = None
+        self.pyramid = None
+        self.lines = []
+        self.redraw = None
         self.fig1, self.axs1 = plt.subplots(1, 1)
         plt.tight_layout(pad=2)
         self.fig1.patch.set_facecolor('#F8C15A')
@@ -221,7 +237,6 @@ class EegGui:
         self.eegline = FigureCanvasTkAgg(self.fig1, self.pagedis[0])
         self.eegline.get_tk_widget().grid(row=1, column=0, sticky=N+E+W+S, pady=5, padx=5)
 
-        self.y2 = []
         self.ys2 = None
         self.fig2, self.axs2 = plt.subplots(1, 1)
         plt.tight_layout(pad=2)
@@ -432,6 +447,15 @@ class EegGui:
         self.bar.grid(row=11, column=0, columnspan=3, sticky=E+W, pady=5, padx=5)
         self.bar.grid_remove()
 
+        self.modTyplbl = ttk.Label(self.pagectr[3], text="Model:", style='ControlsL.TLabel')
+        self.modTyplbl.grid(row=12, column=0, sticky=N+E, pady=2, padx=0)
+        self.allLabels['ControlsL.TLabel'].append(self.modTyplbl)
+
+        self.varModel = tk.StringVar()
+        self.modTypmnu = ttk.OptionMenu(self.pagectr[3], self.varModel, et.MODELS[0], *et.MODELS, style='TMenubutton')
+        self.modTypmnu.grid(row=12, column=1, sticky=N+W)
+        self.allLabels['TMenubutton'].append(self.modTypmnu)
+
         self.modFeasep = ttk.Separator(self.pagectr[3], style='Controls.TSeparator')
         self.modFeasep.grid(row=0, column=3, columnspan=2, sticky=E+W, pady=5, padx=5)
         self.modFealbl = ttk.Label(self.pagectr[3], text='Feature Selection', style='Controls.TLabel')
@@ -663,23 +687,16 @@ class EegGui:
         # File Variables
         self.file = ''
         self.filename = ''
-        self.filenumber = 0
-        self.filelist = []
         self.folder = ''
+        self.ingest = None
+        self.trainparams = None
+        self.cache = ec.FeatureCache()
 
-        # Pre-processing DataFrames
-        self.eegdf = pd.DataFrame()
-        fftheading = ['Freq', 'EEG1fft', 'EEG2fft', 'EEG3fft', 'EEG4fft']
-        self.fftdf = pd.DataFrame(columns=fftheading)
+        # Pre-processing Data (samples x Marker, EEG1..EEG4)
+        self.eegdata = None
 
         # Features Extraction
-        self.trainheading = []
-        for sensor in ['1', '2', '3', '4']:
-            for feat in ['delta', 'theta', 'alpha', 'beta', 'gamma', 'phi',
-                         'theta/beta', 'theta/alpha', 'theta/phi',
-                         'theta/(beta + alpha + gamma)', 'delta/(beta + alpha + gamma)',
-                         'delta/alpha', 'delta/phi', 'delta/beta', 'delta/theta', '(theta + alpha)/beta']:
-                self.trainheading.append('Sen{}-{}'.format(sensor, feat))
+        self.trainheading = list(ef.FEATURENAMES)
         self.trainheading.append('Class')
         self.trainheading.append('File')
 
@@ -776,34 +793,81 @@ class EegGui:
     #
     # Description:
     #       This method is used to cycle the displayed plot on page 2. Clicking
-    # on the figure will draw the next set of data in the itertools objects.
+    # on the figure will draw the next stage of the itertools objects. A
+    # stage that is still being computed in the background is drawn once it
+    # is ready.
     #
     # -------------------------------------------------------------------------
     def switchplot(self, event):
         # Matplotlib.Pyplot Settings
         plt.subplots_adjust(left=0.02, right=0.98, bottom=0.1, top=0.9, wspace=0, hspace=0.1)
 
-        # Time Domain Plot
+        self.shown = (next(self.ys1), next(self.ys2))
+        if not self.view.stageready(self.shown[0]):
+            self.view.request(self.shown[0])
+        if not self.view.spectrumready(self.shown[1]):
+            self.view.request(self.shown[1], spectrum=True)
+        self.plotstage(self.view, self.shown[0])
+        self.plotspectrum(self.view, self.shown[1])
+
+    # -------------------------------------------------------------------------
+    # plotstage / plotspectrum
+    #
+    # Description:
+    #       These methods draw a stage of the View Data page, polling until
+    # the background thread has computed it. A poll is dropped when another
+    # file or stage was selected in the meantime, and stops with an error
+    # message when the stage could not be computed.
+    #
+    # -------------------------------------------------------------------------
+    def plotstage(self, view, i):
+        if view is not self.view or i != self.shown[0]:
+            return
+        if not view.stageready(i):
+            if view.error(i) is not None:
+                messagebox.showerror('Time Domain', 'Cannot compute {} {}: {}'.format(
+                    self.file, ev.STAGES[i] or 'Final', view.error(i)))
+            else:
+                self.master.after(50, self.plotstage, view, i)
+            return
+
+        # Time Domain Plot, the lines are filled in by redraweeg
         self.axs1.cla()
-        y1 = next(self.ys1)
-        y1.plot(kind='line', x='Time', legend=True, ax=self.axs1, linewidth=0.3)
+        self.pyramid = view.pyramid(i)
+        self.lines = [self.axs1.plot([], [], linewidth=0.3, label=col + ev.STAGES[i])[0] for col in ef.CHANNELS]
+        low, high = self.pyramid.limits()
+        margin = (high - low) * 0.05
+        self.axs1.set_ylim(low - margin, high + margin)
+        self.axs1.legend()
         self.axs1.set_title('Time Domain:{}'.format(self.file))
         self.axs1.set_xlabel('Time, [s]')
         self.axs1.set_ylabel('EEG Signal, [uV]')
-        self.fig1.canvas.draw()
+
+        # Call to update the time axis variables
+        self.ploteeg()
+
+    def plotspectrum(self, view, i):
+        if view is not self.view or i != self.shown[1]:
+            return
+        if not view.spectrumready(i):
+            if view.error(i, spectrum=True) is not None:
+                messagebox.showerror('Frequency Domain', 'Cannot compute {} {} spectrum: {}'.format(
+                    self.file, ev.SPECTRA[i] or 'Final', view.error(i, spectrum=True)))
+            else:
+                self.master.after(50, self.plotspectrum, view, i)
+            return
 
         # Frequency Domain Plot
         self.axs2.cla()
-        y2 = next(self.ys2)
-        y2.plot(kind='line', x='Freqp', legend=True, ax=self.axs2, linewidth=0.3)
+        freq, y2 = view.pyramid(i, spectrum=True).window(0, view.fs / 2, self.pixels(self.axs2))
+        for j, col in enumerate(ef.CHANNELS):
+            self.axs2.plot(freq, y2[j], linewidth=0.3, label=col + ev.SPECTRA[i] + 'fftp')
+        self.axs2.legend()
         self.axs2.set_title('Frequency Domain:{}'.format(self.file))
         self.axs2.set_xlabel('Frequency, [Hz]')
         self.axs2.set_ylabel('EEG Amplitude, [uV]')
         self.fig2.canvas.draw()
 
-        # Call to update the time axis variables
-        self.ploteeg()
-
     # -------------------------------------------------------------------------
     # switchfont
     #
@@ -924,16 +988,12 @@ class EegGui:
         self.filename = filedialog.askopenfilename()
         self.file = os.path.basename(self.filename)
 
-        # Read the file into a pandas data frame
-        rawdf = pd.read_csv(self.filename)
-
-        # Select the Desired Columns
-        self.eegdf = rawdf[['Marker', 'EEG1', 'EEG2', 'EEG3', 'EEG4']].copy()
-        self.eegdf = self.eegdf.dropna()
+        # Read the Desired Columns, memory-mapped once converted
+        self.eegdata = er.load(self.filename)
 
         # Refresh the marker option based on marker values
         self.selMrkmnu['menu'].delete(0, 'end')
-        for mark in sorted(rawdf.Marker.unique()):
+        for mark in np.unique(self.eegdata[:, 0]).tolist():
             self.selMrkmnu['menu'].add_command(label=mark, command=lambda x=mark: self.varMrk.set(x))
 
         # Process the raw data
@@ -1044,39 +1104,41 @@ class EegGui:
 
         self.minrow = [100000] * 5
         self.maxrow = [0] * 5
-        self.filelist = iter(sorted(os.listdir(self.folder)))
-        self.bar.grid()
-        self.bar.config(maximum=len(os.listdir(self.folder)), value=0)
         self.testing = test
 
-        self.master.after(1, self.collectcsv)
+        # Process the recordings in worker processes
+        if self.ingest is not None:
+            self.ingest.cancel()
+        if test == "Train":
+            self.trainparams = self.getparams()
+        self.ingest = ei.Ingest(self.folder, self.getparams(), test == "Train", cache=self.cache)
+        self.bar.grid()
+        self.bar.config(maximum=len(self.ingest.files), value=0)
+
+        self.master.after(1, self.collectcsv, self.ingest)
 
-    def collectcsv(self):
-        self.file = next(self.filelist, "end")
-        if self.file != "end":
+    # -------------------------------------------------------------------------
+    # collectcsv
+    #
+    # Description:
+    #       This method collects the recordings processed so far, in file
+    # order, and checks again later until every recording is done.
+    #
+    # -------------------------------------------------------------------------
+    def collectcsv(self, ingest):
+        if ingest is not self.ingest:
+            return
+        for self.file, feats in ingest.poll():
             self.bar.step()
-            self.bar.update_idletasks()
-            self.mainpage.update_idletasks()
-            self.filename = "{}/{}".format(self.folder, self.file)
-
-            # Read the file into a pandas data frame
-            rawdf = pd.read_csv(self.filename)
-
-            # Select the Desired Columns
-            self.eegdf = rawdf[['Marker', 'EEG1', 'EEG2', 'EEG3', 'EEG4']].copy()
-            self.eegdf = self.eegdf.dropna()
-            # Prepare the
-            self.filenumber = int(''.join(c for c in self.file if c.isdigit()))
-            feats = self.preprocess()
             if self.testing == "Train":
                 self.trainlist.extend(feats)
             else:
                 self.testlist.extend(feats)
 
-            # Test the Data
-            self.master.after(1, self.collectcsv)
-        else:
+        if ingest.done():
             self.bar.grid_remove()
+        else:
+            self.master.after(50, self.collectcsv, ingest)
 
     # -------------------------------------------------------------------------
     # switchdomain
@@ -1100,189 +1162,62 @@ class EegGui:
             self.varPlot = 1
 
     # -------------------------------------------------------------------------
-    # preprocess
+    # getparams
     #
     # Description:
-    #       This method does all the pre-processing before extracting features.
+    #       This method returns the pre-processing settings of the sliders.
     #
     # -------------------------------------------------------------------------
-    def preprocess(self):
-        fs = 250
-        window = self.varWindow.get()
-        pulsemax = self.varPulsemax.get()
-        datalist = []
-
-        # Change the 20 into a variable
-        if self.useMark:
-            self.eegdf = self.eegdf.loc[(self.eegdf['Marker'] < 20)].copy()
-            self.eegdf.reset_index(inplace=True)
-
-        # Signal Pre-Processing
-        [b, a] = signal.butter(4, [self.varLowCut.get() / fs, self.varHighCut.get() / fs], btype='bandpass')
-        self.eegdf['Total'] = 0
-        self.eegdf = (self.eegdf - self.eegdf.mean())*1.64498               # Convert into uV
-        for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-            self.eegdf[col] = signal.filtfilt(b, a, self.eegdf[col])        # Apply the bandpass filter
-        self.eegdf['Total'] = self.eegdf.abs().mean(axis=1)                 # Record the Average Amplitude
-
-        # Remove High Amplitude Spikes
-#        for i in range(0, 10, 1):
-#            if not (self.eegdf['Total'] > pulsemax).sum():
-#                break
-        while (self.eegdf['Total'] > pulsemax).sum():
-            self.eegdf = self.eegdf[self.eegdf['Total'] < pulsemax].copy()
-            for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-                self.eegdf[col] = signal.filtfilt(b, a, self.eegdf[col])
-            self.eegdf['Total'] = self.eegdf.abs().mean(axis=1)             # Record the Average Amplitude
-
-        self.eegdf.reset_index(inplace=True)
-        size = self.eegdf.shape[0]
-
-        # Add a time column 250 Hz
-        time = np.linspace(0, size/fs, size)
-        self.eegdf.insert(0, "Time", time)
-
-        # Prepare the Frequency Data Frame
-        self.fftdf['Freq'] = np.linspace(0.0, fs / 2, fs*window // 2 + 1)
-        self.fftdf.set_index("Freq")
-
-        for i in range(0, size, window*fs):
-            df = self.eegdf.iloc[i:i+window*fs]
-            N = df.shape[0]
-            for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-                if df[col].shape[0]:
-                    fft = fftpack.fft(df[col].to_numpy())[0:N // 2 + 1]
-                    fft = 1 / (fs * N) * np.abs(fft) ** 2
-                    fft[2:-2] = [2 * x for x in fft[2:-2]]
-                    self.fftdf[col + 'fft'] = pd.Series(fft)
-            if N:
-                datalist.append(self.extractfeatures(self.fftdf))
-
-        return datalist
+    def getparams(self):
+        return {'fs': ef.FS,
+                'window': self.varWindow.get(),
+                'lowcut': self.varLowCut.get(),
+                'highcut': self.varHighCut.get(),
+                'pulsemax': self.varPulsemax.get(),
+                'usemark': self.useMark}
 
     # -------------------------------------------------------------------------
     # getbands
     #
     # Description:
-    #       This method splits the data in the bands of interest. Before
-    # calculating the next band, the lower frequency bands are subtracted.
+    #       This method pre-processes the data for the View Data page. The
+    # stages are kept in a compact eegview.StageView; only the filtered
+    # stages are computed before the first plot, the bands of interest and
+    # the spectra follow in a background thread. The bands are split with the
+    # method of the Bands menu.
     #
     # -------------------------------------------------------------------------
     def getbands(self):
-        fs = 250
-        fband = [4, 8, 15, 32, 100]
-        wband = [2 * x / fs for x in fband]
-        pulsemax = self.varPulsemax.get()
-
-        # Change the 20 into a variable
-        if self.useMark:
-            self.eegdf = self.eegdf[(self.eegdf['Marker'] < 20)].copy()
-            self.eegdf.reset_index(inplace=True)
+        if self.view is not None:
+            self.view.close()
 
         # Signal Pre-Processing
-        [b, a] = signal.butter(4, [self.varLowCut.get() / fs, self.varHighCut.get() / fs], btype='bandpass')
-        self.eegdf['Total'] = 0
-
-        for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-            self.eegdf[col + 'Raw'] = self.eegdf[col].copy()
-            self.eegdf[col] -= 800# self.eegdf[col].mean()                       # Remove the mean offset (~800 Muse Units)
-            self.eegdf.loc[:, col] *= 1.64498                               # Convert into uV
-            self.eegdf[col + 'uV'] = self.eegdf[col].copy()
-            self.eegdf[col] = signal.filtfilt(b, a, self.eegdf[col])        # Apply the bandpass filter
-            self.eegdf[col + 'Filter'] = self.eegdf[col].copy()
-            self.eegdf['Total'] += abs(self.eegdf[col]) / 4                 # Record the Average Amplitude
-
-        # Remove High Amplitude Spikes
-        self.eegdf = self.eegdf[self.eegdf['Total'] < pulsemax].copy()
-        for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-            self.eegdf[col] = signal.filtfilt(b, a, self.eegdf[col])
-        #while not self.eegdf[self.eegdf['Total'] > 15].copy().empty:
-        #    self.eegdf = self.eegdf[self.eegdf['Total'] < 15].copy()        # Remove High Amplitude Samples
-        #    self.eegdf['Total'] = 0                                         # Reset the Average Amplitude
-        #    for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-        #        self.eegdf[col] = signal.filtfilt(b, a, self.eegdf[col])    # Re-apply bandpass filter
-        #        self.eegdf['Total'] += abs(self.eegdf[col]) / 4             # Record Average Amplitude
-
-        self.eegdf.reset_index(inplace=True)
-        size = self.eegdf.shape[0]
+        self.view = ev.StageView(self.eegdata,
+                                 fs=ef.FS,
+                                 lowcut=self.varLowCut.get(),
+                                 highcut=self.varHighCut.get(),
+                                 pulsemax=self.varPulsemax.get(),
+                                 usemark=self.useMark,
+                                 mode=self.varBandmode.get())
+        self.eegdata = None
 
         # Plot a Histogram of the Signal Amplitude
-        self.fig5.gca().hist(self.eegdf['Total'], bins=100, log=True)
+        self.fig5.gca().hist(self.view.total, bins=100, log=True)
         self.axs5.set_title('Histogram'.format(self.file))
         self.axs5.set_xlabel('Difference')
         self.axs5.set_ylabel('Occurrences')
         self.fig5.canvas.draw()
 
-        # Add a time column 250 Hz
-        time = [1/fs * x for x in range(0, size)]
-        self.eegdf.insert(0, "Time", time)
-
         # Adjust the X Axis Control Widgets
-        self.axiWidsld.config(to=self.eegdf["Time"].max())
-        self.varXoffset.set(self.eegdf["Time"].max()/2)
-        self.varXwidth.set(self.eegdf["Time"].max())
-
-        b = [None] * 5
-        a = [None] * 5
-        for i, band in enumerate(wband):
-            [b[i], a[i]] = signal.butter(4, band)
-
-        # Separate the desired bands into EEG Bands
-        for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-            # First EEG Band Delta 0-4 Hz
-            self.eegdf[col + 'Delta'] = self.eegdf[col]
-            self.eegdf[col + 'Delta'] = signal.filtfilt(b[0], a[0], self.eegdf[col+'Delta'])
-
-            # Second EEG Band Theta 4-8 Hz
-            self.eegdf[col + 'Theta'] = self.eegdf[col] \
-                .subtract(self.eegdf[col + 'Delta'])
-            self.eegdf[col + 'Theta'] = signal.filtfilt(b[1], a[1], self.eegdf[col+'Theta'])
-
-            # Third EEG Band Alpha 8-15 Hz
-            self.eegdf[col + 'Alpha'] = self.eegdf[col] \
-                .subtract(self.eegdf[col + 'Delta']) \
-                .subtract(self.eegdf[col + 'Theta'])
-            self.eegdf[col + 'Alpha'] = signal.filtfilt(b[2], a[2], self.eegdf[col+'Alpha'])
-
-            # Fourth EEG Band Beta 15-32 Hz
-            self.eegdf[col + 'Beta'] = self.eegdf[col] \
-                .subtract(self.eegdf[col + 'Delta']) \
-                .subtract(self.eegdf[col + 'Theta']) \
-                .subtract(self.eegdf[col + 'Alpha'])
-            self.eegdf[col + 'Beta'] = signal.filtfilt(b[3], a[3], self.eegdf[col+'Beta'])
-
-            # Fifth EEG Band Gamma +32 Hz
-            self.eegdf[col + 'Gamma'] = self.eegdf[col] \
-                .subtract(self.eegdf[col + 'Delta']) \
-                .subtract(self.eegdf[col + 'Theta']) \
-                .subtract(self.eegdf[col + 'Alpha']) \
-                .subtract(self.eegdf[col + 'Beta'])
-            self.eegdf[col + 'Gamma'] = signal.filtfilt(b[4], a[4], self.eegdf[col+'Gamma'])
-
-        # Plot the Time Domain
-        self.y1 = []
-        for i, band in enumerate(['', 'Raw', 'uV', 'Filter', 'Delta', 'Theta', 'Alpha', 'Beta', 'Gamma']):
-            self.y1.append(self.eegdf[['Time', 'EEG1'+band, 'EEG2'+band, 'EEG3'+band, 'EEG4'+band]].copy()) # 'Total'
-
-        self.ys1 = it.cycle(self.y1)
-
-        # Plot the Fourier Transform
-        self.eegdf['Freqp'] = pd.Series(np.linspace(0.0, fs / 2, size // 2))
-
-        self.y2 = []
-        for i, band in enumerate(['', 'Delta', 'Theta', 'Alpha', 'Beta', 'Gamma']):
-            for col in ['EEG1', 'EEG2', 'EEG3', 'EEG4']:
-                fft = fftpack.fft(self.eegdf[col+band].to_numpy())[0:size // 2 + 1]
-                fft = 1/(fs*size) * np.abs(fft)**2
-                fft[2:-2] = [2 * x for x in fft[2:-2]]
-                self.eegdf[col + band + 'fftp'] = pd.Series(fft)
-            self.y2.append(self.eegdf[['Freqp',
-                                       'EEG1' + band + 'fftp',
-                                       'EEG2' + band + 'fftp',
-                                       'EEG3' + band + 'fftp',
-                                       'EEG4' + band + 'fftp']].copy())
-
-        self.ys2 = it.cycle(self.y2)
+        tmax = self.view.time[-1] if self.view.size else 0
+        self.axiWidsld.config(to=tmax)
+        self.varXoffset.set(tmax/2)
+        self.varXwidth.set(tmax)
+
+        # Plot the Time Domain and the Fourier Transform
+        self.ys1 = it.cycle(range(len(ev.STAGES)))
+        self.ys2 = it.cycle(range(len(ev.SPECTRA)))
+        self.view.prefetch()
 
         # Call to plot the graph
         self.switchplot(None)
@@ -1291,17 +1226,39 @@ class EegGui:
     # ploteeg
     #
     # Description:
-    #       This method draws the EEG data.
+    #       This method draws the EEG data. The slider callbacks arrive much
+    # faster than a figure can be drawn, so the redraw is deferred and every
+    # change until then is drawn by the same redraweeg call.
     #
     # -------------------------------------------------------------------------
     def ploteeg(self, *args):
         self.axiOffsld.config(from_=self.varXwidth.get()/2, to=self.axiWidsld['to'] - self.varXwidth.get()/2)
+        if self.redraw is None:
+            self.redraw = self.master.after(30, self.redraweeg)
+
+    # -------------------------------------------------------------------------
+    # redraweeg
+    #
+    # Description:
+    #       This method draws the time domain plot for the current axis
+    # settings. Only the samples inside the x limits are drawn, at about two
+    # points per pixel of the figure.
+    #
+    # -------------------------------------------------------------------------
+    def redraweeg(self):
+        self.redraw = None
         width = self.varXwidth.get() * self.varXFwidth.get() / 100
         lowlim = self.varXoffset.get() - width/2
         upperlim = lowlim + width
         self.axs1.set_xlim(lowlim, upperlim)
+        if self.lines:
+            time, y1 = self.pyramid.window(lowlim, upperlim, self.pixels(self.axs1))
+            for line, y in zip(self.lines, y1):
+                line.set_data(time, y)
         self.fig1.canvas.draw()
-        self.fig2.canvas.draw()
+
+    def pixels(self, axs):
+        return max(int(axs.get_window_extent().width), 1)
 
     # -------------------------------------------------------------------------
     # plotfeature
@@ -1329,50 +1286,12 @@ class EegGui:
     # -------------------------------------------------------------------------
     def plotmarker(self, *args):
         self.axs4.cla()
-        df = self.eegdf.loc[self.eegdf['Marker'] == self.varMrk.get()]
-        df[['Time', 'EEG1', 'EEG2', 'EEG3', 'EEG4']].plot(kind='line', x='Time', legend=False, ax=self.axs4)
-
-    # -------------------------------------------------------------------------
-    # extractfeatures
-    #
-    # Description:
-    #       This method extracts features from the data.
-    #
-    # -------------------------------------------------------------------------
-    def extractfeatures(self, freqdf):
-        # Holds the features for Machine Learning
-        feat = []
-
-        # Split the Data Frame by the EEG Bands
-        window = self.varWindow.get()
-
-        deltamean = freqdf.iloc[:4*window].mean()
-        thetamean = freqdf.iloc[4*window+1:8*window].mean()
-        alphamean = freqdf.iloc[8*window+1:15*window].mean()
-        betamean = freqdf.iloc[15*window+1:32*window].mean()
-        gammamean = freqdf.iloc[32*window+1:].mean()
-        freqmean = freqdf.mean()
-
-        for sensor in ['EEG1fft', 'EEG2fft', 'EEG3fft', 'EEG4fft']:
-            delta = deltamean[sensor]
-            theta = thetamean[sensor]
-            alpha = alphamean[sensor]
-            beta = betamean[sensor]
-            gamma = gammamean[sensor]
-            phi = freqmean[sensor]
-
-            feat.extend([delta, theta, alpha, beta, gamma, phi, theta/beta, theta/alpha, theta/phi,
-                         theta/(beta + alpha + gamma), delta/(beta + alpha + gamma), delta/alpha, delta/phi,
-                         delta/beta, delta/theta, (theta + alpha)/beta])
-
-        # Check for 'Early' for the old dataset.
-        # Check for 'pre' for the new Mining Dataset
-        mental = "Not Fatigued" if 'pre' in self.filename else "Fatigued"
-        if self.testing == "Train":
-            feat.extend([mental, self.filenumber % 5])
-        else:
-            feat.extend([mental, self.filenumber])
-        return feat
+        if self.view is None:
+            return
+        mark = self.view.marker == self.varMrk.get()
+        y = self.view.stage(ev.STAGES.index(''))[:, mark]
+        for j in range(len(ef.CHANNELS)):
+            self.axs4.plot(self.view.time[mark], y[j])
 
     # -------------------------------------------------------------------------
     # train
@@ -1382,40 +1301,24 @@ class EegGui:
     #
     # -------------------------------------------------------------------------
     def train(self):
-        self.traindf = pd.DataFrame(self.trainlist, columns=self.trainheading)
-        self.traindf = self.traindf.dropna()
+        self.traindf = et.frame(self.trainlist)
         self.X = self.traindf.loc[:, self.tstInclst.get(0, END)].copy()
-        x = (self.X - self.X.mean(axis=0))/self.X.std(axis=0)
-
-        x = x.to_numpy()
-        y = self.traindf.loc[:, "Class"].to_numpy()
 
         # Hyperparameters to Test
         #param_grid = {'C': [0.008, 0.009, 0.01, 0.012, 0.013],
         #              'gamma': [0.008, 0.009, 0.01, 0.012, 0.013],
-        param_grid = {'C': [1],
-                      'gamma': ['scale'],
-                      'kernel': ['rbf'],
-                      'class_weight': ['balanced']}
-
-        # Cross Validation Split by 5 -> Split by File Number % 5
-        group = PredefinedSplit(self.traindf['File'].tolist())
-        clf = SVC(kernel='rbf')
-
-        self.clf = GridSearchCV(clf, param_grid, refit=True, verbose=3, n_jobs=-1, pre_dispatch=8, cv=group)
-        self.clf.fit(x, y)
+        self.clf, mean, var = et.train(self.traindf, self.X.columns, self.varModel.get())
 
         self.varPerfValid.set(self.clf.best_score_)
         print(self.clf.best_estimator_)
-        predict = self.clf.predict(x)
-        sens, spec, posp, negp = self.evaluate(y, predict)
+        stats = et.score(self.clf, self.traindf, self.X.columns, mean, var)
 
-        self.varSensTrain.set(sens)
-        self.varSpecTrain.set(spec)
-        self.varPospTrain.set(posp)
-        self.varNegpTrain.set(negp)
+        self.varSensTrain.set(stats['sensitivity'])
+        self.varSpecTrain.set(stats['specificity'])
+        self.varPospTrain.set(stats['positive predictive'])
+        self.varNegpTrain.set(stats['negative predictive'])
 
-        self.varPerfTrain.set((sens * spec) ** (1 / 2))
+        self.varPerfTrain.set(stats['performance'])
 
     # -------------------------------------------------------------------------
     # test
@@ -1425,27 +1328,17 @@ class EegGui:
     #
     # -------------------------------------------------------------------------
     def test(self):
-        self.testdf = pd.DataFrame(self.testlist, columns=self.trainheading)
-        self.testdf = self.testdf.dropna()
-
-        # Prepare Test Matrix
-        x = self.testdf.loc[:, self.tstInclst.get(0, END)].copy()
-        x = (x - self.X.mean(axis=0)) / self.X.std(axis=0)
-        x = x.to_numpy()
-
-        # Set Grand Truth Aside
-        y = self.testdf.loc[:, "Class"].to_numpy()
+        self.testdf = et.frame(self.testlist)
 
         # Evaluate the Classifier
-        predict = self.clf.predict(x)
-        sens, spec, posp, negp = self.evaluate(y, predict)
+        stats = et.score(self.clf, self.testdf, self.X.columns, self.X.mean(axis=0), self.X.std(axis=0))
 
-        self.varSensTest.set(sens)
-        self.varSpecTest.set(spec)
-        self.varPospTest.set(posp)
-        self.varNegpTest.set(negp)
+        self.varSensTest.set(stats['sensitivity'])
+        self.varSpecTest.set(stats['specificity'])
+        self.varPospTest.set(stats['positive predictive'])
+        self.varNegpTest.set(stats['negative predictive'])
 
-        self.varPerfTest.set((sens * spec) ** (1 / 2))
+        self.varPerfTest.set(stats['performance'])
         # Reset the Test Data Frame and List
         self.testdf = self.testdf.iloc[0:0]
         # self.testlist = []
@@ -1454,35 +1347,15 @@ class EegGui:
     # test
     #
     # Description:
-    #       This method saves the trained model with a pickler.
+    #       This method saves the trained model, its statistics, features
+    # and pre-processing parameters as one eegmodel bundle.
     #
     # -------------------------------------------------------------------------
     def save(self):
         # Save the trained model.
-        pd.DataFrame(self.trainlist, columns=self.trainheading).dropna().to_csv('trainlist.csv')
-        pd.DataFrame(self.testlist, columns=self.trainheading).dropna().to_csv('testlist.csv')
-        filename = 'finalized_model.sav'
-        pk.dump(self.clf.best_estimator_, open(filename, 'wb'))
-        mean = self.X.mean(axis=0)
-        var = self.X.std(axis=0)
-        pk.dump(mean, open('mean.sav', 'wb'))
-        pk.dump(var, open('var.sav', 'wb'))
-
-    # -------------------------------------------------------------------------
-    # test
-    #
-    # Description:
-    #       This method tests the classifier.
-    #
-    # -------------------------------------------------------------------------
-    def evaluate(self, truth, predict):
-        tn, fp, fn, tp = confusion_matrix(truth, predict, labels=["Fatigued", "Not Fatigued"]).ravel()
-        print(tn, tp, fn, fp)
-        sensitivity = tn / (tn + fp)
-        specificity = tp / (tp + fn)
-        pospred = tn / (tn + fn)
-        negpred = tp / (tp + fp)
-        return sensitivity, specificity, pospred, negpred
+        et.frame(self.trainlist).to_csv('trainlist.csv')
+        et.frame(self.testlist).to_csv('testlist.csv')
+        et.save(self.clf.best_estimator_, self.X.mean(axis=0), self.X.std(axis=0), params=self.trainparams)
 
     # -------------------------------------------------------------------------
     # onClose
@@ -1506,6 +1379,8 @@ if __name__ == "__main__":
     game = EegGui(master=root)
     root.mainloop()
     root.quit()
+    if game.view is not None:
+        game.view.close(wait=True)
 
     # Profiler End
     if useProfile:
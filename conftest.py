@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import eegfeatures as ef
+
+
+# -----------------------------------------------------------------------------
+# recording
+#
+# Description:
+#       A synthetic Muse recording (samples x Marker, EEG1..EEG4): the Muse
+# offset, a 10 Hz rhythm and noise on every channel, with optional bursts of
+# high amplitude spikes.
+#
+# -----------------------------------------------------------------------------
+def synthetic(seconds=180, seed=0, spikes=0, fs=ef.FS):
+    rng = np.random.default_rng(seed)
+    t = np.arange(seconds * fs) / fs
+    data = np.zeros((t.size, len(ef.COLUMNS)))
+    for c in range(len(ef.CHANNELS)):
+        data[:, c + 1] = ef.OFFSET + 6 * np.sin(2 * np.pi * 10 * t + c) + 3 * rng.standard_normal(t.size)
+    for start in rng.integers(0, t.size - 30, spikes):
+        data[start:start + 30, 1:] += rng.normal(0, 200, (30, len(ef.CHANNELS)))
+    return data
+
+
+@pytest.fixture
+def recording():
+    return synthetic
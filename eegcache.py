@@ -0,0 +1,160 @@
+# |ECE 499: Feature Cache|-----------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: Persistent Feature Cache
+#
+# Description:
+#      Stores the extracted features of every recording on disk so that
+# selecting the same data again does not re-read and re-filter the CSV
+# files. An entry is keyed by the content hash of the recording and the
+# pre-processing parameters, so renamed files still hit and changed settings
+# miss. The cache is capped in size and the least recently used entries are
+# evicted first.
+#
+# Usage:
+#       python eegcache.py info
+#       python eegcache.py clear
+#       python eegcache.py trim [--max MB]
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+import eegfeatures as ef
+
+# |SETTINGS|-------------------------------------------------------------------
+CACHEDIR = os.environ.get('EEG_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'featurecache'))
+MAXBYTES = 512 * 2**20
+VERSION = 3             # Bump when the feature pipeline changes its output
+
+
+def hashfile(filename, blocksize=2**20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+# FeatureCache
+#
+# Description:
+#       One .npy file of features (windows x 64) per entry. Reading an entry
+# refreshes its modification time, which is the LRU order used by trim().
+#
+# -----------------------------------------------------------------------------
+class FeatureCache:
+    def __init__(self, path=CACHEDIR, maxbytes=MAXBYTES):
+        self.path = path
+        self.maxbytes = maxbytes
+
+    def key(self, filename, params):
+        settings = dict(params, order=ef.ORDER, version=VERSION)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(hashfile(filename).encode('ascii'))
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key + '.npy')
+
+    def get(self, key):
+        try:
+            feats = np.load(self.entry(key))
+            os.utime(self.entry(key))
+            return feats
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, feats):
+        os.makedirs(self.path, exist_ok=True)
+        temp = self.entry(key) + '.{}.tmp'.format(os.getpid())
+        with open(temp, 'wb') as f:
+            np.save(f, np.asarray(feats, dtype=np.float64))
+        os.replace(temp, self.entry(key))
+
+    # -------------------------------------------------------------------------
+    # features
+    #
+    # Description:
+    #       This method returns the features of a recording, computing and
+    # storing them only on a miss. params holds the keyword arguments of
+    # eegfeatures.features.
+    #
+    # -------------------------------------------------------------------------
+    def features(self, filename, params, compute):
+        key = self.key(filename, params)
+        feats = self.get(key)
+        if feats is None:
+            feats = compute(filename, params)
+            self.put(key, feats)
+        return feats
+
+    def entries(self):
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npy'):
+                st = os.stat(os.path.join(self.path, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        return sorted(entries)
+
+    # -------------------------------------------------------------------------
+    # trim
+    #
+    # Description:
+    #       This method evicts the least recently used entries until the
+    # cache fits in maxbytes. Returns the number of entries removed.
+    #
+    # -------------------------------------------------------------------------
+    def trim(self, maxbytes=None):
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in entries:
+            if total <= maxbytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        return self.trim(0)
+
+    def info(self):
+        entries = self.entries()
+        return {'path': self.path,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max bytes': self.maxbytes}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect or clear the EEG feature cache.')
+    parser.add_argument('command', choices=['info', 'clear', 'trim'])
+    parser.add_argument('--path', default=CACHEDIR)
+    parser.add_argument('--max', type=float, default=MAXBYTES / 2**20, help='size cap in MB')
+    args = parser.parse_args()
+
+    cache = FeatureCache(args.path, int(args.max * 2**20))
+    if args.command == 'clear':
+        print('Removed {} entries'.format(cache.clear()))
+    elif args.command == 'trim':
+        print('Removed {} entries'.format(cache.trim()))
+    for name, value in cache.info().items():
+        print('{}:\t{}'.format(name, value))
+    sys.exit(0)
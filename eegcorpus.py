@@ -0,0 +1,164 @@
+# |ECE 499: EEG Corpus|--------------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: Recording Corpus
+#
+# Description:
+#      A folder of recordings converted for training. Every recording is a
+# (samples x Marker, EEG1..EEG4) float32 .npy file that is opened as a
+# read-only memory map, so slicing it copies nothing and worker processes
+# reading the same recording share its pages. index.json lists the
+# recordings with their file number, fatigue label, sample count and the
+# ranges of every marker value.
+#
+# A corpus folder can be used wherever a folder of CSV recordings is
+# expected (Select Train/Test, eegingest.Ingest) and a corpus .npy file
+# wherever a CSV recording is (View Data, mentalclient --raw).
+#
+# Usage:
+#       python eegcorpus.py build <csv folder> <corpus folder>
+#       python eegcorpus.py info <corpus folder>
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import eegfeatures as ef
+import eegreader as er
+
+from concurrent.futures import ProcessPoolExecutor
+
+# |SETTINGS|-------------------------------------------------------------------
+INDEX = 'index.json'
+VERSION = 1
+
+
+def filenumber(file):
+    return int(''.join(c for c in file if c.isdigit()))
+
+
+# -----------------------------------------------------------------------------
+# markerranges
+#
+# Description:
+#       This function returns the runs of equal marker values as
+# [marker, start, stop] rows, stop excluded.
+#
+# -----------------------------------------------------------------------------
+def markerranges(marker):
+    if not marker.size:
+        return []
+    edges = np.concatenate([[0], np.flatnonzero(np.diff(marker)) + 1, [marker.size]])
+    return [[float(marker[start]), int(start), int(stop)] for start, stop in zip(edges[:-1], edges[1:])]
+
+
+# -----------------------------------------------------------------------------
+# addrecording
+#
+# Description:
+#       This function converts one CSV recording into the corpus folder and
+# returns its index entry.
+#
+# -----------------------------------------------------------------------------
+def addrecording(filename, path):
+    name = os.path.splitext(os.path.basename(filename))[0] + '.npy'
+    samples = er.convert(filename, os.path.join(path, name))
+    data = np.load(os.path.join(path, name), mmap_mode='r')
+    return {'name': name,
+            'source': os.path.basename(filename),
+            'number': filenumber(os.path.basename(filename)),
+            'label': ef.label(filename),
+            'samples': samples,
+            'markers': markerranges(data[:, 0])}
+
+
+# -----------------------------------------------------------------------------
+# Corpus
+#
+# Description:
+#       Opens a corpus folder. recording() and marker() return memory-mapped
+# views; nothing is read until the samples are used.
+#
+# -----------------------------------------------------------------------------
+class Corpus:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX)) as f:
+            index = json.load(f)
+        if index['version'] != VERSION:
+            raise ValueError('corpus version {} is not {}'.format(index['version'], VERSION))
+        self.entries = {entry['name']: entry for entry in index['recordings']}
+
+    # -------------------------------------------------------------------------
+    # build
+    #
+    # Description:
+    #       This method converts every recording of a folder of CSV files on
+    # a process pool and writes the index. Returns the opened Corpus.
+    #
+    # -------------------------------------------------------------------------
+    @classmethod
+    def build(cls, folder, path, workers=None):
+        os.makedirs(path, exist_ok=True)
+        files = [os.path.join(folder, file) for file in sorted(os.listdir(folder))]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            entries = list(pool.map(addrecording, files, [path] * len(files)))
+        with open(os.path.join(path, INDEX), 'w') as f:
+            json.dump({'version': VERSION, 'columns': ef.COLUMNS, 'dtype': er.DTYPE.str, 'recordings': entries},
+                      f, indent=1)
+        return cls(path)
+
+    def names(self):
+        return sorted(self.entries)
+
+    def filename(self, name):
+        return os.path.join(self.path, name)
+
+    def recording(self, name):
+        return np.load(self.filename(name), mmap_mode='r')
+
+    # -------------------------------------------------------------------------
+    # marker
+    #
+    # Description:
+    #       This method returns the samples of every run of a marker value as
+    # a list of views on the recording.
+    #
+    # -------------------------------------------------------------------------
+    def marker(self, name, mark):
+        data = self.recording(name)
+        return [data[start:stop] for value, start, stop in self.entries[name]['markers'] if value == mark]
+
+    def info(self):
+        labels = [entry['label'] for entry in self.entries.values()]
+        return {'path': self.path,
+                'recordings': len(self.entries),
+                'samples': sum(entry['samples'] for entry in self.entries.values()),
+                'fatigued': labels.count('Fatigued'),
+                'not fatigued': labels.count('Not Fatigued')}
+
+
+def iscorpus(folder):
+    return os.path.isfile(os.path.join(folder, INDEX))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or inspect an EEG recording corpus.')
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('folders', nargs='+', help='build: <csv folder> <corpus folder>, info: <corpus folder>')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        corpus = Corpus.build(args.folders[0], args.folders[1], args.workers)
+    else:
+        corpus = Corpus(args.folders[0])
+    for name, value in corpus.info().items():
+        print('{}:\t{}'.format(name, value))
+    sys.exit(0)
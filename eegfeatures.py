@@ -0,0 +1,483 @@
+# |ECE 499: EEG Features|------------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: EEG Feature Extraction
+#
+# Description:
+#      Signal processing used to turn raw Muse recordings into the band power
+# features of the classifier. The functions work on NumPy arrays and take
+# their parameters explicitly so that they can be used without the GUI.
+#
+#      Cut-off frequencies follow the GUI sliders: they are normalized by fs
+# rather than by the Nyquist frequency, so a value of 100 is a 50 Hz corner.
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import functools
+import warnings
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import ndimage, signal, fft as sfft
+
+# |CONSTANTS|------------------------------------------------------------------
+FS = 250                # Muse sample rate, [Hz]
+UV = 1.64498            # Muse units to uV
+COLUMNS = ['Marker', 'EEG1', 'EEG2', 'EEG3', 'EEG4']
+CHANNELS = COLUMNS[1:]
+MARKMAX = 20            # Markers kept when only the marked data is used
+
+OFFSET = 800            # Muse mean offset removed for viewing
+FBAND = [4, 8, 15, 32, 100]     # Upper edge of each EEG band, [Hz]
+BANDS = ['Delta', 'Theta', 'Alpha', 'Beta', 'Gamma']
+
+# Default pre-processing parameters (GUI slider defaults)
+WINDOW = 4
+LOWCUT = 1
+HIGHCUT = 100
+PULSEMAX = 15
+ORDER = 4
+REJECTION = 'iterative'
+MAXPASSES = 10          # Refilter passes allowed by the iterative spike rejection
+
+FEATURES = ['delta', 'theta', 'alpha', 'beta', 'gamma', 'phi',
+            'theta/beta', 'theta/alpha', 'theta/phi',
+            'theta/(beta + alpha + gamma)', 'delta/(beta + alpha + gamma)',
+            'delta/alpha', 'delta/phi', 'delta/beta', 'delta/theta', '(theta + alpha)/beta']
+FEATURENAMES = ['Sen{}-{}'.format(sensor, feat) for sensor in ['1', '2', '3', '4'] for feat in FEATURES]
+
+
+# -----------------------------------------------------------------------------
+# label
+#
+# Description:
+#       This function returns the ground truth of a recording. Check for
+# 'Early' for the old dataset and for 'pre' for the new Mining Dataset.
+#
+# -----------------------------------------------------------------------------
+def label(filename):
+    return "Not Fatigued" if 'pre' in filename else "Fatigued"
+
+
+# -----------------------------------------------------------------------------
+# design
+#
+# Description:
+#       This function is the registry of Butterworth filters. It returns the
+# coefficients (b, a) or the second order sections for an order, normalized
+# cut-off(s) (1 = Nyquist) and btype. Designs are memoized with a bounded LRU
+# cache used by the GUI, the ingestion workers and the server; hits and
+# misses are reported by filterstats(). The returned arrays are shared, so
+# they are made read-only.
+#
+# -----------------------------------------------------------------------------
+@functools.lru_cache(maxsize=64)
+def design(order, cutoffs, btype='lowpass', output='ba'):
+    coefficients = signal.butter(order, list(cutoffs) if isinstance(cutoffs, tuple) else cutoffs,
+                                 btype=btype, output=output)
+    for array in coefficients if isinstance(coefficients, tuple) else [coefficients]:
+        array.flags.writeable = False
+    return coefficients
+
+
+def filterstats():
+    return design.cache_info()._asdict()
+
+
+def bandpass(lowcut, highcut, fs=FS, order=ORDER):
+    return design(order, (lowcut / fs, highcut / fs), 'bandpass')
+
+
+# -----------------------------------------------------------------------------
+# artifactmask
+#
+# Description:
+#       This function marks the samples whose average amplitude reaches
+# pulsemax, widened by dilate samples on each side.
+#
+# -----------------------------------------------------------------------------
+def artifactmask(total, pulsemax=PULSEMAX, dilate=0):
+    bad = total >= pulsemax
+    if dilate and bad.any():
+        bad = ndimage.maximum_filter1d(bad.view(np.uint8), 2 * dilate + 1) > 0
+    return bad
+
+
+# -----------------------------------------------------------------------------
+# preprocess
+#
+# Description:
+#       This function converts the raw samples into filtered uV signals.
+# data holds the Marker, EEG1..EEG4 columns (samples x 5). The samples are
+# centered, converted into uV and bandpass filtered. The average amplitude
+# of a sample includes the marker (and, while iterating, the previous
+# average), as the GUI always did. High amplitude spikes are then removed
+# with one of the rejection methods:
+#
+#       'iterative' removes the samples above pulsemax and filters the rest
+#           again until no sample is above the limit, for at most maxpasses
+#           refilter passes; samples still above the limit after the last
+#           pass are removed without refiltering.
+#       'mask'      removes the samples of the dilated artifact mask in one
+#           pass and filters the rest once.
+#       'window'    removes every window of window seconds that holds an
+#           artifact; the kept windows are not filtered again.
+#
+# When report is a dict, it is filled with the number of samples and windows
+# of the recording, how many were dropped and the refilter passes used.
+# center is the mean removed from the samples, by default their own mean, and
+# only the samples in rejectrange (start, stop) are rejected, by default all
+# of them. A stream filters each block with some samples around it; it
+# passes the mean of everything received so far and the range of the block,
+# so the filter transients at the edges of the extra samples are not
+# mistaken for spikes.
+#
+# Returns the filtered channels (4 x samples); the array is empty when every
+# sample was rejected. With withindex, the position of every kept sample in
+# data (after the NaN and marker rows are dropped) is returned as well.
+#
+# -----------------------------------------------------------------------------
+def preprocess(data, fs=FS, lowcut=LOWCUT, highcut=HIGHCUT, pulsemax=PULSEMAX, usemark=False,
+               rejection=REJECTION, maxpasses=MAXPASSES, dilate=0, window=WINDOW, report=None, center=None,
+               rejectrange=None, withindex=False):
+    data = np.asarray(data, dtype=np.float64)
+    data = data[~np.isnan(data).any(axis=1)]
+    if usemark:
+        data = data[data[:, 0] < MARKMAX]
+
+    [b, a] = bandpass(lowcut, highcut, fs)
+    padlen = 3 * max(len(a), len(b))
+    size = data.shape[0]
+    step = window * fs
+    index = np.arange(size)                                             # Original position of kept samples
+    judged = np.zeros(size, dtype=bool)                                 # Samples that may be rejected
+    judged[slice(*rejectrange) if rejectrange is not None else slice(None)] = True
+    passes = 0
+    eeg = np.empty((len(CHANNELS), 0))
+
+    if size > padlen:
+        if center is None:
+            center = data.mean(axis=0)
+        data = (data - center) * UV                                     # Convert into uV
+        marker = np.abs(data[:, 0])
+        eeg = signal.filtfilt(b, a, data[:, 1:].T, axis=-1)             # Apply the bandpass filter
+        # Record the Average Amplitude
+        total = (marker + np.abs(eeg).sum(axis=0)) / (len(COLUMNS) + 1)
+
+        # Remove High Amplitude Spikes
+        if rejection == 'iterative':
+            while ((total > pulsemax) & judged[index]).any():
+                keep = (total < pulsemax) | ~judged[index]
+                marker, eeg, total, index = marker[keep], eeg[:, keep], total[keep], index[keep]
+                if index.size <= padlen or passes == maxpasses:
+                    break
+                eeg = signal.filtfilt(b, a, eeg, axis=-1)
+                total = (marker + np.abs(eeg).sum(axis=0) + total) / (len(COLUMNS) + 1)
+                passes += 1
+        elif rejection == 'mask':
+            keep = ~(artifactmask(total, pulsemax, dilate) & judged)
+            if not keep.all():
+                eeg, index = eeg[:, keep], index[keep]
+                if index.size > padlen:
+                    eeg = signal.filtfilt(b, a, eeg, axis=-1)
+                    passes = 1
+        elif rejection == 'window':
+            bad = artifactmask(total, pulsemax, dilate) & judged
+            badwindow = np.logical_or.reduceat(bad, np.arange(0, size, step))
+            keep = ~np.repeat(badwindow, step)[:size]
+            eeg, index = eeg[:, keep], index[keep]
+        else:
+            raise ValueError("rejection must be 'iterative', 'mask' or 'window', not {!r}".format(rejection))
+    else:
+        index = index[:0]
+
+    if index.size <= padlen and rejection != 'window':
+        eeg, index = np.empty((len(CHANNELS), 0)), index[:0]
+
+    if report is not None:
+        windows = -(-size // step)
+        kept = np.bincount(index // step, minlength=windows)
+        report.update({'samples': size,
+                       'dropped samples': size - index.size,
+                       'windows': windows,
+                       'dropped windows': int((kept == 0).sum()),
+                       'passes': passes})
+    if withindex:
+        return eeg, index
+    return eeg
+
+
+# -----------------------------------------------------------------------------
+# viewstages
+#
+# Description:
+#       This function prepares a recording for viewing. The Muse offset is
+# removed, the samples are converted into uV and bandpass filtered. Samples
+# whose average amplitude exceeds pulsemax are removed once and the remaining
+# signal is filtered again.
+#
+# Returns a dict of the kept samples: 'Marker' and 'Total' (samples) and the
+# 'Raw', 'uV', 'Filter' and '' (final) stages (4 x samples). With
+# final=False the second filter pass is left to the caller.
+#
+# -----------------------------------------------------------------------------
+def viewstages(data, fs=FS, lowcut=LOWCUT, highcut=HIGHCUT, pulsemax=PULSEMAX, usemark=False, final=True):
+    data = np.asarray(data, dtype=np.float64)
+    data = data[~np.isnan(data).any(axis=1)]
+    if usemark:
+        data = data[data[:, 0] < MARKMAX]
+
+    [b, a] = bandpass(lowcut, highcut, fs)
+    raw = data[:, 1:].T
+    uv = (raw - OFFSET) * UV                                            # Convert into uV
+    filt = signal.filtfilt(b, a, uv, axis=-1)                           # Apply the bandpass filter
+    total = np.abs(filt).sum(axis=0) / len(CHANNELS)                    # Record the Average Amplitude
+
+    # Remove High Amplitude Spikes
+    keep = total < pulsemax
+    stages = {'Marker': data[keep, 0],
+              'Total': total[keep],
+              'Raw': raw[:, keep],
+              'uV': uv[:, keep],
+              'Filter': filt[:, keep]}
+    if final:
+        stages[''] = signal.filtfilt(b, a, stages['Filter'], axis=-1)
+    return stages
+
+
+# -----------------------------------------------------------------------------
+# bandfilters
+#
+# Description:
+#       This function returns the filter bank of the EEG bands as second
+# order sections: a lowpass up to the first edge, then a bandpass between
+# consecutive edges. A band reaching the Nyquist frequency is a highpass.
+#
+# -----------------------------------------------------------------------------
+def bandfilters(fs=FS, fband=FBAND, order=ORDER):
+    sos = []
+    low = 0
+    nyquist = fs / 2
+    for high in fband:
+        if not low:
+            sos.append(design(order, high / nyquist, 'lowpass', 'sos'))
+        elif high >= nyquist:
+            sos.append(design(order, low / nyquist, 'highpass', 'sos'))
+        else:
+            sos.append(design(order, (low / nyquist, high / nyquist), 'bandpass', 'sos'))
+        low = high
+    return sos
+
+
+# -----------------------------------------------------------------------------
+# getband / getbands
+#
+# Description:
+#       These functions split the channels into the EEG bands. getband
+# returns one band (channels x samples), getbands all of them
+# (len(fband) x channels x samples).
+#
+#       'filterbank' applies the band filters of bandfilters to every
+# channel at once with sosfiltfilt along the sample axis. 'subtractive' is
+# the original method: before calculating the next band, the lower bands
+# are subtracted and the remainder is lowpass filtered at the upper edge of
+# the band; getband then expects that remainder as eeg.
+#
+# -----------------------------------------------------------------------------
+def getband(eeg, band, fs=FS, fband=FBAND, order=ORDER, mode='filterbank'):
+    if mode == 'filterbank':
+        sos = bandfilters(fs, fband, order)[band].copy()                # sosfilt needs writable sections
+        return signal.sosfiltfilt(sos, eeg, axis=-1)
+    if mode == 'subtractive':
+        [b, a] = design(order, 2 * fband[band] / fs)
+        return signal.filtfilt(b, a, eeg, axis=-1)
+    raise ValueError("mode must be 'filterbank' or 'subtractive', not {!r}".format(mode))
+
+
+def getbands(eeg, fs=FS, fband=FBAND, order=ORDER, mode='filterbank'):
+    eeg = np.asarray(eeg, dtype=np.float64)
+    bands = np.empty((len(fband),) + eeg.shape)
+    rest = eeg.copy() if mode == 'subtractive' else eeg
+    for i in range(len(fband)):
+        bands[i] = getband(rest, i, fs, fband, order, mode)
+        if mode == 'subtractive':
+            rest -= bands[i]
+    return bands
+
+
+# -----------------------------------------------------------------------------
+# periodogram
+#
+# Description:
+#       This function returns the one-sided periodogram of signals along the
+# last axis (... x samples -> ... x bins).
+#
+# -----------------------------------------------------------------------------
+def periodogram(x, fs=FS):
+    N = x.shape[-1]
+    psd = np.abs(sfft.rfft(x, axis=-1)) ** 2
+    psd *= 1 / (fs * N)
+    psd[..., 2:-2] *= 2
+    return psd
+
+
+# -----------------------------------------------------------------------------
+# spectrum
+#
+# Description:
+#       This function returns the frequencies and the one-sided periodogram
+# of whole signals (... x samples), as drawn on the View Data page.
+#
+# -----------------------------------------------------------------------------
+def spectrum(x, fs=FS):
+    size = x.shape[-1]
+    return np.linspace(0.0, fs / 2, size // 2), periodogram(x, fs)[..., :size // 2]
+
+
+# -----------------------------------------------------------------------------
+# periodograms
+#
+# Description:
+#       This function splits the channels into windows of window seconds and
+# returns the periodograms of all full windows in one array
+# (windows x channels x bins). The windows are strided views of the signal,
+# so the whole recording is transformed in a single rfft call. A shorter
+# last window is returned as a second array of one window.
+#
+# -----------------------------------------------------------------------------
+def periodograms(eeg, fs=FS, window=WINDOW):
+    step = window * fs
+    size = eeg.shape[1]
+    psds = []
+    if size >= step:
+        windows = sliding_window_view(eeg, step, axis=-1)[:, ::step]     # channels x windows x samples
+        psds.append(periodogram(windows.transpose(1, 0, 2), fs))
+    if size % step:
+        psds.append(periodogram(eeg[np.newaxis, :, size - size % step:], fs))
+    return psds
+
+
+# -----------------------------------------------------------------------------
+# bandmatrix
+#
+# Description:
+#       This function returns the (bins x bands) matrix that averages a
+# periodogram over the delta, theta, alpha, beta, gamma and full (phi)
+# bands, and which of the bands hold no bins. Bin k of a window of window
+# seconds is at k / window Hz; the bins on the band edges are left out.
+# The matrix is built once per (bins, window).
+#
+# -----------------------------------------------------------------------------
+@functools.lru_cache(maxsize=32)
+def bandmatrix(bins, window):
+    edges = [(0, 4 * window), (4 * window + 1, 8 * window), (8 * window + 1, 15 * window),
+             (15 * window + 1, 32 * window), (32 * window + 1, None), (0, None)]
+    matrix = np.zeros((bins, len(edges)))
+    empty = np.zeros(len(edges), dtype=bool)
+    for j, (start, stop) in enumerate(edges):
+        index = range(bins)[start:stop]
+        if len(index):
+            matrix[index.start:index.stop, j] = 1 / len(index)
+        else:
+            empty[j] = True
+    matrix.flags.writeable = False
+    empty.flags.writeable = False
+    return matrix, empty
+
+
+# -----------------------------------------------------------------------------
+# ratiomatrices
+#
+# Description:
+#       This function returns the numerator and denominator matrices
+# (bands + 1 x FEATURES) of the features. The extra row is a constant 1 so
+# that the band powers themselves are ratios over 1.
+#
+# -----------------------------------------------------------------------------
+def ratiomatrices():
+    delta, theta, alpha, beta, gamma, phi, one = range(7)
+    ratios = {'delta': ([delta], [one]),
+              'theta': ([theta], [one]),
+              'alpha': ([alpha], [one]),
+              'beta': ([beta], [one]),
+              'gamma': ([gamma], [one]),
+              'phi': ([phi], [one]),
+              'theta/beta': ([theta], [beta]),
+              'theta/alpha': ([theta], [alpha]),
+              'theta/phi': ([theta], [phi]),
+              'theta/(beta + alpha + gamma)': ([theta], [beta, alpha, gamma]),
+              'delta/(beta + alpha + gamma)': ([delta], [beta, alpha, gamma]),
+              'delta/alpha': ([delta], [alpha]),
+              'delta/phi': ([delta], [phi]),
+              'delta/beta': ([delta], [beta]),
+              'delta/theta': ([delta], [theta]),
+              '(theta + alpha)/beta': ([theta, alpha], [beta])}
+    numerator = np.zeros((7, len(FEATURES)))
+    denominator = np.zeros((7, len(FEATURES)))
+    for j, feat in enumerate(FEATURES):
+        numerator[ratios[feat][0], j] = 1
+        denominator[ratios[feat][1], j] = 1
+    return numerator, denominator
+
+
+NUMERATOR, DENOMINATOR = ratiomatrices()
+DEPENDS = (NUMERATOR[:-1] + DENOMINATOR[:-1]) > 0                       # Bands used by each feature
+
+
+# -----------------------------------------------------------------------------
+# extractfeatures
+#
+# Description:
+#       This function computes the 16 band power features of every channel
+# from the periodograms of windows (windows x channels x bins). The band
+# powers of all windows and channels come from one product with the band
+# matrix and the ratios from two products with the ratio matrices. Features
+# of a band without bins are NaN. Returns one contiguous row per window
+# ordered as FEATURENAMES (windows x 64).
+#
+# -----------------------------------------------------------------------------
+def extractfeatures(psd, window=WINDOW):
+    matrix, empty = bandmatrix(psd.shape[-1], window)
+    powers = np.ones(psd.shape[:-1] + (matrix.shape[1] + 1,))
+    powers[..., :-1] = psd @ matrix
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        feat = (powers @ NUMERATOR) / (powers @ DENOMINATOR)
+    if empty.any():
+        feat[..., DEPENDS[empty].any(axis=0)] = np.nan
+    return np.ascontiguousarray(feat.reshape(feat.shape[0], -1))
+
+
+# -----------------------------------------------------------------------------
+# features
+#
+# Description:
+#       This function runs the whole pipeline on a raw recording and returns
+# one row of FEATURENAMES per window (windows x 64). The spike rejection
+# arguments and report are those of preprocess; report also gets the number
+# of feature rows and of rows holding NaN features. A RuntimeWarning is
+# issued when a non-empty recording gives no rows (every window rejected)
+# or rows with NaN features (a window too short for every band), since the
+# training drops those rows.
+#
+# -----------------------------------------------------------------------------
+def features(data, fs=FS, window=WINDOW, lowcut=LOWCUT, highcut=HIGHCUT, pulsemax=PULSEMAX, usemark=False,
+             rejection=REJECTION, maxpasses=MAXPASSES, dilate=0, report=None):
+    stats = {}
+    eeg = preprocess(data, fs, lowcut, highcut, pulsemax, usemark, rejection, maxpasses, dilate, window, stats)
+    rows = [extractfeatures(psd, window) for psd in periodograms(eeg, fs, window)]
+    feat = np.vstack(rows) if rows else np.empty((0, len(FEATURENAMES)))
+    nanrows = int(np.isnan(feat).any(axis=1).sum())
+    stats.update({'rows': feat.shape[0], 'nan rows': nanrows})
+    if report is not None:
+        report.update(stats)
+
+    if stats['samples'] and not feat.shape[0]:
+        warnings.warn('every window was rejected ({} of {} samples dropped with {!r} rejection)'
+                      .format(stats['dropped samples'], stats['samples'], rejection), RuntimeWarning, stacklevel=2)
+    elif nanrows:
+        warnings.warn('{} of {} windows have NaN features'.format(nanrows, feat.shape[0]),
+                      RuntimeWarning, stacklevel=2)
+    return feat
@@ -0,0 +1,122 @@
+# |ECE 499: EEG Ingestion|-----------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: Dataset Ingestion
+#
+# Description:
+#      Turns a folder of Muse recordings into labelled feature rows. Each
+# recording is processed in its own worker process and the results are
+# returned in file order, so the GUI and the batch jobs can build the
+# training and testing lists on all cores.
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import os
+
+import eegcorpus as eco
+import eegfeatures as ef
+import eegreader as er
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+def readrecording(filename):
+    return er.load(filename)
+
+
+# -----------------------------------------------------------------------------
+# labelrows
+#
+# Description:
+#       This function appends the ground truth and the file number to the
+# features of every window. Training rows keep the file number modulo 5,
+# which is the cross validation fold.
+#
+# -----------------------------------------------------------------------------
+def labelrows(feats, filename, number, train):
+    mental = ef.label(filename)
+    fold = number % 5 if train else number
+    return [row.tolist() + [mental, fold] for row in feats]
+
+
+def computefeatures(filename, params):
+    return ef.features(readrecording(filename), **params)
+
+
+# -----------------------------------------------------------------------------
+# ingestfile
+#
+# Description:
+#       This function returns the labelled feature rows of one recording.
+# params holds the keyword arguments of eegfeatures.features. With a
+# FeatureCache the recording is only processed when it is not cached yet.
+#
+# -----------------------------------------------------------------------------
+def ingestfile(filename, params, train, cache=None):
+    if cache is None:
+        feats = computefeatures(filename, params)
+    else:
+        feats = cache.features(filename, params, computefeatures)
+    return labelrows(feats, filename, eco.filenumber(os.path.basename(filename)), train)
+
+
+# -----------------------------------------------------------------------------
+# Ingest
+#
+# Description:
+#       Fans the recordings of a folder out over a process pool, one
+# recording per task. poll() returns the results that are ready, in file
+# order, without blocking; results() waits for all of them. The cache is
+# trimmed to its size cap once every recording is done. folder is either a
+# folder of CSV recordings or an eegcorpus folder.
+#
+#       A recording that fails gives no rows, so the GUI carries on with the
+# others; the error is printed and kept in failed (file -> message) for the
+# batch jobs to check.
+#
+# -----------------------------------------------------------------------------
+class Ingest:
+    def __init__(self, folder, params, train, workers=None, cache=None):
+        if eco.iscorpus(folder):
+            self.files = eco.Corpus(folder).names()
+        else:
+            self.files = sorted(os.listdir(folder))
+        self.cache = cache
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.futures = [self.pool.submit(ingestfile, "{}/{}".format(folder, file), params, train, cache)
+                        for file in self.files]
+        self.next = 0
+        self.failed = {}
+
+    def done(self):
+        return self.next == len(self.futures)
+
+    def collect(self):
+        file = self.files[self.next]
+        future = self.futures[self.next]
+        self.next += 1
+        try:
+            return file, future.result()
+        except Exception as err:
+            print('failed to ingest {}: {}'.format(file, err))
+            self.failed[file] = '{}: {}'.format(type(err).__name__, err)
+            return file, []
+        finally:
+            if self.done():
+                self.pool.shutdown()
+                if self.cache is not None:
+                    self.cache.trim()
+
+    def poll(self):
+        ready = []
+        while not self.done() and self.futures[self.next].done():
+            ready.append(self.collect())
+        return ready
+
+    def results(self):
+        while not self.done():
+            yield self.collect()
+
+    def cancel(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,303 @@
+# |ECE 499: EEG Model|---------------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: Model Bundle
+#
+# Description:
+#      Stores a trained classifier in one file together with everything
+# needed to use it: the mean and standard deviation of the features, the
+# ordered feature names, the pre-processing parameters and a schema version.
+#
+#      The file starts with MAGIC, the length of a JSON header and the
+# header, followed by raw array sections aligned to ALIGN bytes. The
+# estimator is pickled with protocol 5 and its arrays (support vectors, dual
+# coefficients, ...) are written as out-of-band sections, so loading memory
+# maps the file and the estimator uses the mapped arrays without copying
+# them; server processes loading the same bundle share its pages. Loading
+# does not need pandas.
+#
+#      A two class RBF SVC is also exported as plain arrays (support vectors,
+# dual coefficients, intercept) with its gamma in the header. The arrays
+# are the out-of-band sections of the pickled estimator, so they are stored
+# once. RbfSVC evaluates that export with NumPy alone, so load(native=True)
+# gives the inference processes a model without importing scikit-learn. The
+# export is checked against SVC.decision_function when it is saved.
+#
+# Usage:
+#       python eegmodel.py info [model.bamf]
+#       python eegmodel.py convert finalized_model.sav mean.sav var.sav [--out model.bamf]
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import argparse
+import json
+import os
+import pickle as pk
+import struct
+import sys
+
+import numpy as np
+
+# |SETTINGS|-------------------------------------------------------------------
+MODELFILE = 'model.bamf'
+MAGIC = b'BAMFMODEL\0'
+LENGTH = struct.Struct('<Q')
+SCHEMA = 1              # Bump when the header or the section layout changes
+ALIGN = 64
+TOLERANCE = 1e-9        # Largest relative error of an RbfSVC export
+BLOCK = 1024            # Rows per kernel block in RbfSVC, [samples]
+
+
+def padding(offset):
+    return -offset % ALIGN
+
+
+# -----------------------------------------------------------------------------
+# Bundle
+#
+# Description:
+#       A loaded model. mean and std are float64 arrays in the order of
+# features; params holds the keyword arguments of eegfeatures.features the
+# model was trained with, or None when they are not known.
+#
+# -----------------------------------------------------------------------------
+class Bundle:
+    def __init__(self, model, mean, std, features, params=None, header=None):
+        self.model = model
+        self.mean = mean
+        self.std = std
+        self.features = features
+        self.params = params
+        self.header = header
+
+
+# -----------------------------------------------------------------------------
+# RbfSVC
+#
+# Description:
+#       Decision function of a two class RBF SVC from its exported arrays:
+# sum_i dual_coef[i] * exp(-gamma * |x - sv_i|^2) + intercept. The squared
+# distances are expanded as |x|^2 + |sv|^2 - 2 x.sv so a batch of rows takes
+# one matrix product per BLOCK rows. Inputs are used as given, without the
+# validation of scikit-learn.
+#
+# -----------------------------------------------------------------------------
+class RbfSVC:
+    def __init__(self, support_vectors, dual_coef, intercept, gamma, classes):
+        self.support_vectors_ = support_vectors
+        self.dual_coef_ = dual_coef
+        self.intercept_ = intercept
+        self.gamma = gamma
+        self.classes_ = np.asarray(classes)
+        self.norms = np.einsum('ij,ij->i', support_vectors, support_vectors)
+
+    def decision_function(self, x):
+        x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        scores = np.empty(x.shape[0])
+        for i in range(0, x.shape[0], BLOCK):
+            block = x[i:i + BLOCK]
+            kernel = block @ self.support_vectors_.T
+            kernel *= -2.0
+            kernel += np.einsum('ij,ij->i', block, block)[:, None]
+            kernel += self.norms
+            np.maximum(kernel, 0.0, out=kernel)
+            kernel *= -self.gamma
+            np.exp(kernel, out=kernel)
+            scores[i:i + BLOCK] = kernel @ self.dual_coef_
+        scores += self.intercept_[0]
+        return scores
+
+    def predict(self, x):
+        return self.classes_[(self.decision_function(x) > 0).astype(int)]
+
+
+# -----------------------------------------------------------------------------
+# export
+#
+# Description:
+#       This function returns the arrays and the header entry of the RbfSVC
+# export of a model, or None when the model is not a two class RBF SVC or
+# the export does not reproduce its decision function on the support
+# vectors and the origin. gamma='scale' depends on the variance of the
+# training data, which the model does not keep; such a model is exported
+# once its gamma is set to the resolved value, as eegtrain.fit does.
+#
+# -----------------------------------------------------------------------------
+def export(model):
+    if type(model).__name__ != 'SVC' or getattr(model, 'kernel', None) != 'rbf' or len(model.classes_) != 2:
+        return None
+    if isinstance(model.gamma, str):
+        if model.gamma != 'auto':
+            return None
+        gamma = 1.0 / model.n_features_in_
+    else:
+        gamma = float(model.gamma)
+    arrays = {'support_vectors': np.ascontiguousarray(model.support_vectors_, dtype=np.float64),
+              'dual_coef': np.ascontiguousarray(model.dual_coef_[0], dtype=np.float64),
+              'intercept': np.ascontiguousarray(model.intercept_, dtype=np.float64)}
+    spec = {'kind': 'rbf-svc', 'gamma': gamma, 'classes': model.classes_.tolist()}
+    native = RbfSVC(arrays['support_vectors'], arrays['dual_coef'], arrays['intercept'], spec['gamma'],
+                    spec['classes'])
+    x = np.vstack([arrays['support_vectors'], np.zeros((1, arrays['support_vectors'].shape[1]))])
+    expected = model.decision_function(x)
+    error = float(np.max(np.abs(native.decision_function(x) - expected)))
+    if not error <= TOLERANCE * max(1.0, float(np.max(np.abs(expected)))):
+        return None
+    spec['error'] = error
+    return arrays, spec
+
+
+# -----------------------------------------------------------------------------
+# featurenames
+#
+# Description:
+#       This function returns the feature names of the statistics saved by
+# older versions: the index of a pandas Series, or all eegfeatures.FEATURENAMES
+# for a plain list or array.
+#
+# -----------------------------------------------------------------------------
+def featurenames(mean):
+    if hasattr(mean, 'reindex'):
+        return [str(name) for name in mean.index]
+    import eegfeatures as ef                                            # Only needed for unnamed statistics
+
+    return list(ef.FEATURENAMES)
+
+
+# -----------------------------------------------------------------------------
+# save
+#
+# Description:
+#       This function writes a model bundle. mean and std may be pandas
+# Series; when features is not given their index is used. The file is
+# written next to its destination and renamed, so a loader never sees a
+# partial bundle. A two class RBF SVC is exported for RbfSVC as well.
+#
+# -----------------------------------------------------------------------------
+def save(filename, model, mean, std, features=None, params=None):
+    if features is None:
+        if not hasattr(mean, 'reindex'):
+            raise ValueError('the feature names are needed when mean is not a Series')
+        features = list(mean.index)
+    arrays = {'mean': np.ascontiguousarray(mean, dtype=np.float64),
+              'std': np.ascontiguousarray(std, dtype=np.float64)}
+    buffers = []
+    payload = pk.dumps(model, protocol=5, buffer_callback=buffers.append)
+    raws = [np.frombuffer(buffer.raw(), dtype=np.uint8) for buffer in buffers]
+
+    # An exported array is a view on the pickle buffer with the same bytes;
+    # only the arrays without one get a section of their own
+    native = export(model)
+    shared = {}
+    for name, array in (native[0] if native is not None else {}).items():
+        data = array.view(np.uint8).reshape(-1)
+        match = [i for i, raw in enumerate(raws) if raw.nbytes == data.nbytes and np.array_equal(raw, data)]
+        if match:
+            shared[name] = (array, match[0])
+        else:
+            arrays[name] = array
+    sections = list(arrays.values()) + [np.frombuffer(payload, dtype=np.uint8)] + raws
+
+    # Lay the sections out after the header; the header size depends on the
+    # offsets, so they are counted from the end of the header block
+    offsets = []
+    offset = 0
+    for section in sections:
+        offsets.append(offset)
+        offset += section.nbytes + padding(section.nbytes)
+    first = len(arrays) + 1                                             # Section of the first pickle buffer
+    layout = {name: {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offsets[i]}
+              for i, (name, array) in enumerate(arrays.items())}
+    layout.update({name: {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offsets[first + i]}
+                   for name, (array, i) in shared.items()})
+    header = {'schema': SCHEMA,
+              'model': type(model).__name__,
+              'features': [str(feature) for feature in features],
+              'params': params,
+              'arrays': layout,
+              'pickle': {'offset': offsets[len(arrays)], 'size': len(payload)},
+              'buffers': [{'offset': offsets[i], 'size': sections[i].nbytes} for i in range(first, len(sections))],
+              'native': native[1] if native is not None else None}
+    if len(header['features']) != arrays['mean'].shape[0]:
+        raise ValueError('{} feature names for {} means'.format(len(header['features']), arrays['mean'].shape[0]))
+    text = json.dumps(header).encode('utf-8')
+    start = len(MAGIC) + LENGTH.size + len(text)
+    start += padding(start)
+
+    temp = filename + '.{}.tmp'.format(os.getpid())
+    with open(temp, 'wb') as f:
+        f.write(MAGIC + LENGTH.pack(start) + text)
+        f.write(b'\0' * (start - f.tell()))
+        for section in sections:
+            f.write(section.tobytes())
+            f.write(b'\0' * padding(section.nbytes))
+    os.replace(temp, filename)
+
+
+# -----------------------------------------------------------------------------
+# load
+#
+# Description:
+#       This function opens a model bundle. With mmap the arrays are views on
+# a read-only memory map of the file, otherwise the file is read into
+# memory. With native the model is the RbfSVC export when the bundle has
+# one, and the estimator is not unpickled.
+#
+# -----------------------------------------------------------------------------
+def load(filename, mmap=True, native=False):
+    if mmap:
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+    else:
+        data = np.fromfile(filename, dtype=np.uint8)
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('{} is not a model bundle'.format(filename))
+    start, = LENGTH.unpack(bytes(data[len(MAGIC):len(MAGIC) + LENGTH.size]))
+    header = json.loads(bytes(data[len(MAGIC) + LENGTH.size:start]).rstrip(b'\0').decode('utf-8'))
+    if header['schema'] != SCHEMA:
+        raise ValueError('model bundle schema {} is not {}'.format(header['schema'], SCHEMA))
+    body = data[start:]
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        size = dtype.itemsize * int(np.prod(spec['shape']))
+        arrays[name] = body[spec['offset']:spec['offset'] + size].view(dtype).reshape(spec['shape'])
+    spec = header.get('native')
+    if native and spec is not None:
+        model = RbfSVC(arrays['support_vectors'], arrays['dual_coef'], arrays['intercept'], spec['gamma'],
+                       spec['classes'])
+        return Bundle(model, arrays['mean'], arrays['std'], header['features'], header['params'], header)
+    payload = body[header['pickle']['offset']:header['pickle']['offset'] + header['pickle']['size']]
+    buffers = [memoryview(body[spec['offset']:spec['offset'] + spec['size']]) for spec in header['buffers']]
+    model = pk.loads(memoryview(payload), buffers=buffers)
+    return Bundle(model, arrays['mean'], arrays['std'], header['features'], header['params'], header)
+
+
+def info(filename):
+    header = load(filename, native=True).header
+    return {'file': filename,
+            'bytes': os.path.getsize(filename),
+            'schema': header['schema'],
+            'model': header['model'],
+            'features': len(header['features']),
+            'params': header['params'],
+            'buffers': len(header['buffers']),
+            'native': header.get('native')}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect a model bundle or convert the old .sav pickles.')
+    parser.add_argument('command', choices=['info', 'convert'])
+    parser.add_argument('files', nargs='*', help='convert: finalized_model.sav mean.sav var.sav')
+    parser.add_argument('--out', default=MODELFILE)
+    args = parser.parse_args()
+
+    filename = args.files[0] if args.command == 'info' and args.files else args.out
+    if args.command == 'convert':
+        # Bundle a model saved by older versions as three pickles
+        clf, mean, var = [pk.load(open(name, 'rb')) for name in args.files]
+        save(args.out, clf, mean, var, featurenames(mean))
+    for name, value in info(filename).items():
+        print('{}:\t{}'.format(name, value))
+    sys.exit(0)
@@ -0,0 +1,195 @@
+# |ECE 499: EEG Reader|--------------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: Recording Reader
+#
+# Description:
+#      Reads the Marker and EEG columns of a Muse recording. Only those
+# columns are parsed, straight into float32. Every recording is converted
+# once into a .npy file of its samples; later loads memory-map that file
+# instead of parsing the CSV again. The conversion reads the CSV in chunks,
+# with the streaming, multi-threaded pyarrow reader when pyarrow is installed
+# and with the C engine otherwise, so recordings larger than memory can be
+# converted too.
+#
+# Usage:
+#       python eegreader.py convert file.csv [file.csv ...]
+#       python eegreader.py info
+#       python eegreader.py clear
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import argparse
+import hashlib
+import importlib.util
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+import eegcache as ec
+import eegfeatures as ef
+
+# |SETTINGS|-------------------------------------------------------------------
+CACHEDIR = os.environ.get('EEG_RECORDINGS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordingcache'))
+MAXBYTES = 2 * 2**30
+DTYPE = np.dtype('<f4')
+ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+CHUNKSIZE = 2**18       # Rows per chunk when converting, [samples]
+
+
+# -----------------------------------------------------------------------------
+# readcsv / readchunks / readbatches
+#
+# Description:
+#       These functions return the Marker and EEG columns of a recording as
+# (samples x 5) float32 arrays without the rows that have missing values.
+# readchunks yields the recording in pieces: of at most chunksize rows with
+# the C engine, and with pyarrow of the record batches of readbatches: the
+# streaming pyarrow.csv.open_csv reader, which parses blocks of about
+# chunksize rows.
+#
+# -----------------------------------------------------------------------------
+def readcsv(filename, engine=ENGINE):
+    df = pd.read_csv(filename, usecols=ef.COLUMNS, dtype={col: DTYPE for col in ef.COLUMNS}, engine=engine)
+    return df[ef.COLUMNS].dropna().to_numpy()
+
+
+def readchunks(filename, chunksize=CHUNKSIZE, engine='c'):
+    if engine == 'pyarrow':
+        yield from readbatches(filename, chunksize)
+        return
+    with pd.read_csv(filename, usecols=ef.COLUMNS, dtype={col: DTYPE for col in ef.COLUMNS},
+                     chunksize=chunksize) as reader:
+        for df in reader:
+            yield df[ef.COLUMNS].dropna().to_numpy()
+
+
+def readbatches(filename, chunksize=CHUNKSIZE):
+    from pyarrow import csv
+    import pyarrow as pa
+
+    reader = csv.open_csv(filename,
+                          read_options=csv.ReadOptions(block_size=max(chunksize * 64, 1 << 20)),
+                          convert_options=csv.ConvertOptions(include_columns=ef.COLUMNS,
+                                                             column_types={col: pa.float32() for col in ef.COLUMNS}))
+    for batch in reader:
+        chunk = np.column_stack([batch.column(col).to_numpy(zero_copy_only=False) for col in ef.COLUMNS])
+        yield np.ascontiguousarray(chunk[~np.isnan(chunk).any(axis=1)], dtype=DTYPE)
+
+
+# -----------------------------------------------------------------------------
+# convert
+#
+# Description:
+#       This function writes the samples of a CSV recording into a .npy file.
+# The chunks of readchunks are appended to a headerless file first, because
+# the number of kept samples is only known at the end. Returns the number of
+# samples.
+#
+# -----------------------------------------------------------------------------
+def convert(filename, npyfile, chunksize=CHUNKSIZE, engine=ENGINE):
+    temp = npyfile + '.{}.tmp'.format(os.getpid())
+    rows = 0
+    try:
+        with open(temp + '.raw', 'wb') as f:
+            for chunk in readchunks(filename, chunksize, engine):
+                f.write(chunk.tobytes())
+                rows += chunk.shape[0]
+        with open(temp, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(DTYPE),
+                                                     'fortran_order': False,
+                                                     'shape': (rows, len(ef.COLUMNS))})
+            with open(temp + '.raw', 'rb') as raw:
+                shutil.copyfileobj(raw, f)
+        os.replace(temp, npyfile)
+    finally:
+        for leftover in [temp + '.raw', temp]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return rows
+
+
+# -----------------------------------------------------------------------------
+# RecordingCache
+#
+# Description:
+#       The converted recordings, one .npy file each. An entry is keyed by
+# the path, size and modification time of the CSV, so a cached recording is
+# found without reading the CSV at all. Eviction works like the
+# FeatureCache: least recently loaded first.
+#
+# -----------------------------------------------------------------------------
+class RecordingCache(ec.FeatureCache):
+    def __init__(self, path=CACHEDIR, maxbytes=MAXBYTES):
+        super().__init__(path, maxbytes)
+
+    def key(self, filename):
+        st = os.stat(filename)
+        stamp = '{}\0{}\0{}\0{}'.format(os.path.abspath(filename), st.st_size, st.st_mtime_ns, DTYPE.str)
+        return hashlib.blake2b(stamp.encode('utf-8'), digest_size=20).hexdigest()
+
+    def get(self, key):
+        try:
+            data = np.load(self.entry(key), mmap_mode='r')
+            os.utime(self.entry(key))
+            return data
+        except (OSError, ValueError):
+            return None
+
+    # -------------------------------------------------------------------------
+    # recording
+    #
+    # Description:
+    #       This method returns the samples of a recording as a read-only
+    # memory map, converting the CSV on a miss.
+    #
+    # -------------------------------------------------------------------------
+    def recording(self, filename):
+        key = self.key(filename)
+        data = self.get(key)
+        if data is None:
+            os.makedirs(self.path, exist_ok=True)
+            convert(filename, self.entry(key))
+            data = self.get(key)
+            self.trim()
+        return data
+
+
+recordings = RecordingCache()
+
+
+# -----------------------------------------------------------------------------
+# load
+#
+# Description:
+#       This function returns the samples of a recording. A .npy file, such
+# as a recording of an eegcorpus, is memory-mapped as is; a CSV file goes
+# through the recording cache.
+#
+# -----------------------------------------------------------------------------
+def load(filename):
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+    return recordings.recording(filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert EEG recordings or inspect the recording cache.')
+    parser.add_argument('command', choices=['convert', 'info', 'clear'])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--path', default=CACHEDIR)
+    args = parser.parse_args()
+
+    cache = RecordingCache(args.path)
+    if args.command == 'convert':
+        for file in args.files:
+            print('{}:\t{} samples'.format(file, cache.recording(file).shape[0]))
+    elif args.command == 'clear':
+        print('Removed {} entries'.format(cache.clear()))
+    for name, value in cache.info().items():
+        print('{}:\t{}'.format(name, value))
+    sys.exit(0)
@@ -0,0 +1,594 @@
+# |ECE 499: EEG Training|------------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: Classifier Training
+#
+# Description:
+#      Trains the mental fatigue classifier without the GUI: the recordings
+# are ingested, the included features are standardized and an SVC is tuned
+# with GridSearchCV, using the file number modulo 5 as the cross validation
+# fold. The model, the normalization statistics, the feature names and the
+# pre-processing parameters are written as the eegmodel bundle read by
+# mentalfatigue, together with a summary of the scores. The
+# Train Model and Save buttons of the GUI use the same functions.
+#
+# Usage:
+#       python eegtrain.py <folder | corpus | trainlist.csv> [options]
+#       python eegtrain.py data/train --exclude Sen1-gamma Sen2-gamma
+#       python eegtrain.py trainlist.csv --grid '{"C": [0.1, 1, 10], "gamma": ["scale", 0.01]}'
+#       python eegtrain.py data/train --pregrid '{"window": [2, 4], "pulsemax": [10, 15]}' --grid ...
+#       python eegtrain.py trainlist.csv --model nystroem --compare
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import eegcache as ec
+import eegfeatures as ef
+import eegingest as ei
+import eegmodel as em
+
+from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import clone
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import confusion_matrix
+from sklearn.model_selection import GridSearchCV, ParameterGrid, PredefinedSplit
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+
+# |SETTINGS|-------------------------------------------------------------------
+HEADING = list(ef.FEATURENAMES) + ['Class', 'File']
+PARAMGRID = {'C': [1],
+             'gamma': ['scale'],
+             'kernel': ['rbf'],
+             'class_weight': ['balanced']}
+APPROXGRID = {'linear__C': [1]}
+MODELS = ['svc', 'nystroem', 'rff']
+COMPONENTS = 300        # Features of the approximate kernel maps
+PARAMS = {'fs': ef.FS,
+          'window': ef.WINDOW,
+          'lowcut': ef.LOWCUT,
+          'highcut': ef.HIGHCUT,
+          'pulsemax': ef.PULSEMAX,
+          'usemark': False}
+FACTOR = 3              # Successive halving keeps 1/FACTOR of the candidates per rung
+BLOCK = 2048            # Rows of the Gram matrix computed at once
+MAXGRAM = 256 * 2**20   # Larger Gram matrices are memory-mapped from a temporary file, [bytes]
+STATSFILE = 'trainstats.json'
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=HEADING).dropna()
+
+
+# -----------------------------------------------------------------------------
+# ingest
+#
+# Description:
+#       This function returns the labelled feature rows of every recording
+# of a folder (or an eegcorpus folder) as a DataFrame. params holds the
+# keyword arguments of eegfeatures.features.
+#
+#       A recording that cannot be processed raises a RuntimeError naming
+# every failed recording, so no model is trained on part of the data by
+# accident. When failed is a dict, the failures are added to it instead
+# (file -> error) and the other recordings are returned.
+#
+# -----------------------------------------------------------------------------
+def ingest(folder, params, train=True, workers=None, cache=None, failed=None):
+    rows = []
+    job = ei.Ingest(folder, params, train, workers, cache)
+    for file, feats in job.results():
+        rows.extend(feats)
+    if failed is not None:
+        failed.update(job.failed)
+    elif job.failed:
+        raise RuntimeError('failed to ingest {} of {} recordings: {}'.format(
+            len(job.failed), len(job.files), '; '.join('{} ({})'.format(*item) for item in job.failed.items())))
+    return frame(rows)
+
+
+def readfeatures(filename):
+    return pd.read_csv(filename, index_col=0)[HEADING].dropna()
+
+
+# -----------------------------------------------------------------------------
+# standardize
+#
+# Description:
+#       This function returns the included features scaled to zero mean and
+# unit standard deviation, the classes, and the mean and standard deviation
+# of the features.
+#
+# -----------------------------------------------------------------------------
+def standardize(traindf, features):
+    X = traindf.loc[:, list(features)]
+    mean = X.mean(axis=0)
+    var = X.std(axis=0)
+    return ((X - mean) / var).to_numpy(), traindf.loc[:, 'Class'].to_numpy(), mean, var
+
+
+# -----------------------------------------------------------------------------
+# fit
+#
+# Description:
+#       This function standardizes the included features and runs the grid
+# search. The rows of one File value form one fold of the PredefinedSplit.
+# Returns the fitted GridSearchCV and the mean and standard deviation of the
+# features. The gamma of the refit model is set to the number 'scale' or
+# 'auto' resolved to.
+#
+# -----------------------------------------------------------------------------
+def fit(traindf, features, param_grid=PARAMGRID, workers=-1, verbose=3):
+    x, y, mean, var = standardize(traindf, features)
+
+    # Cross Validation Split by 5 -> Split by File Number % 5
+    group = PredefinedSplit(traindf['File'].tolist())
+    clf = GridSearchCV(estimator('svc', x.shape[1]), param_grid, refit=True, verbose=verbose, n_jobs=workers,
+                       pre_dispatch=8, cv=group)
+    clf.fit(x, y)
+    # Record the gamma the refit resolved, so eegmodel can export the model
+    clf.best_estimator_.set_params(gamma=resolvegamma(clf.best_estimator_.gamma, x))
+    return clf, mean, var
+
+
+# -----------------------------------------------------------------------------
+# estimator / fitfold
+#
+# Description:
+#       estimator returns the unfitted estimator of a model name of MODELS
+# for a number of features; fit, approxfit and search all start from it.
+# fitfold scores one candidate on one fold of search.
+#
+# -----------------------------------------------------------------------------
+def estimator(model, features):
+    return SVC(kernel='rbf') if model == 'svc' else approxmodel(model, features)
+
+
+def fitfold(x, y, train, test, model, params):
+    try:
+        return clone(model).set_params(**params).fit(x[train], y[train]).score(x[test], y[test])
+    except ValueError:
+        return np.nan           # A small rung can leave a single class in a fold
+
+
+# -----------------------------------------------------------------------------
+# halvings
+#
+# Description:
+#       This function returns the number of rungs before the last one of a
+# successive halving over count candidates, ceil(log_factor(count)) - 1,
+# counted in integers so that exact powers of factor do not add a rung.
+#
+# -----------------------------------------------------------------------------
+def halvings(count, factor):
+    rungs = 0
+    while factor > 1 and factor ** (rungs + 1) < count:
+        rungs += 1
+    return rungs
+
+
+# -----------------------------------------------------------------------------
+# search
+#
+# Description:
+#       This function searches the pre-processing parameters (pregrid, the
+# keyword arguments of eegfeatures.features) and the parameters of the model
+# (param_grid, for the estimator of train) jointly. The features of every
+# pre-processing candidate are computed once, through the cache, and shared
+# by all of its model candidates. Every (candidate, fold) fit of a rung runs
+# in parallel on workers.
+#
+#       With successive halving (factor > 1) the first rung scores every
+# candidate on a random 1/factor**k of the windows, keeps the best
+# 1/factor of them and multiplies the windows by factor, until the last
+# rung scores the last few candidates on all windows. factor=1 is an
+# exhaustive search.
+#
+# Returns the best (pre-processing, model) parameters, the feature DataFrame
+# of the best pre-processing and the scores of every rung. Raises a
+# ValueError when every candidate of a rung fails to fit. failed is passed
+# to ingest.
+#
+# -----------------------------------------------------------------------------
+def search(folder, features, pregrid, param_grid=PARAMGRID, factor=FACTOR, workers=-1, cache=None,
+           seed=0, verbose=1, model='svc', failed=None):
+    base = estimator(model, len(features))
+    for params in ParameterGrid(param_grid):
+        clone(base).set_params(**params)                                # Reject unknown parameters up front
+    presets = [dict(PARAMS, **preset) for preset in ParameterGrid(pregrid)]
+    frames = [ingest(folder, params, cache=cache, failed=failed) for params in presets]
+    data = [standardize(df, features)[:2] + (df['File'].to_numpy(),) for df in frames]
+    candidates = [(i, params) for i in range(len(presets)) for params in ParameterGrid(param_grid)]
+
+    rungs = halvings(len(candidates), factor)
+    rng = np.random.default_rng(seed)
+    orders = [rng.permutation(len(y)) for x, y, group in data]
+    history = []
+    with Parallel(n_jobs=workers, verbose=verbose) as parallel:
+        for rung in range(rungs + 1):
+            fraction = float(factor) ** (rung - rungs) if rungs else 1.0
+            owner = []
+            jobs = []
+            for k, (i, params) in enumerate(candidates):
+                x, y, group = data[i]
+                rows = np.sort(orders[i][:max(int(len(y) * fraction), 1)])
+                for train, test in PredefinedSplit(group[rows]).split():
+                    owner.append(k)
+                    jobs.append(delayed(fitfold)(x, y, rows[train], rows[test], base, params))
+            folds = np.array(parallel(jobs), dtype=np.float64)
+            scores = np.full(len(candidates), np.nan)
+            for k in range(len(candidates)):
+                if not np.isnan(folds[np.equal(owner, k)]).all():
+                    scores[k] = np.nanmean(folds[np.equal(owner, k)])
+            history.append([{'params': presets[i], 'model': params, 'fraction': fraction, 'score': score}
+                            for (i, params), score in zip(candidates, scores)])
+            if np.isnan(scores).all():
+                raise ValueError('every candidate of rung {} failed to fit on {:.0%} of the windows'.format(
+                    rung, fraction))
+            if verbose:
+                print('rung {}: {} candidates on {:.0%} of the windows, best {:.4f}'.format(
+                    rung, len(candidates), fraction, np.nanmax(scores)))
+            if rung < rungs:
+                keep = np.argsort(-scores, kind='stable')[:math.ceil(len(candidates) / factor)]
+                candidates = [candidates[k] for k in keep]
+
+    i, params = candidates[int(np.nanargmax(scores))]
+    return presets[i], params, frames[i], history
+
+
+# -----------------------------------------------------------------------------
+# sqdistances / gram
+#
+# Description:
+#       These functions fill n x n matrices block by block of rows, so the
+# temporaries stay small: sqdistances the squared euclidean distances
+# between the rows of x, gram the RBF kernel exp(-gamma * d2). out can be a
+# memory map.
+#
+# -----------------------------------------------------------------------------
+def sqdistances(x, out, block=BLOCK):
+    sq = np.einsum('ij,ij->i', x, x)
+    for i in range(0, x.shape[0], block):
+        d2 = sq[i:i + block, np.newaxis] + sq[np.newaxis] - 2 * (x[i:i + block] @ x.T)
+        out[i:i + block] = np.maximum(d2, 0)
+    return out
+
+
+def gram(d2, gamma, out, block=BLOCK):
+    for i in range(0, d2.shape[0], block):
+        np.multiply(d2[i:i + block], -gamma, out=out[i:i + block])
+        np.exp(out[i:i + block], out=out[i:i + block])
+    return out
+
+
+def resolvegamma(gamma, x):
+    if gamma == 'scale':
+        return 1.0 / (x.shape[1] * x.var())
+    if gamma == 'auto':
+        return 1.0 / x.shape[1]
+    return float(gamma)
+
+
+# -----------------------------------------------------------------------------
+# KernelSearch
+#
+# Description:
+#       The result of kernelfit, with the attributes of GridSearchCV that the
+# GUI and the command line use. best_estimator_ is a regular RBF SVC and
+# cv_results_ is laid out like that of GridSearchCV.
+#
+# -----------------------------------------------------------------------------
+class KernelSearch:
+    def __init__(self, best_params_, best_score_, best_estimator_, cv_results_):
+        self.best_params_ = best_params_
+        self.best_score_ = best_score_
+        self.best_estimator_ = best_estimator_
+        self.cv_results_ = cv_results_
+
+    def predict(self, x):
+        return self.best_estimator_.predict(x)
+
+
+# -----------------------------------------------------------------------------
+# kernelfit
+#
+# Description:
+#       This function runs the same search as fit with the RBF Gram matrix
+# computed once per gamma instead of once per fit. The squared distances
+# are computed once; for every gamma the Gram matrix is filled in place and
+# GridSearchCV fits SVC(kernel='precomputed') for every fold and remaining
+# parameter on slices of it. Matrices larger than maxbytes live in memory
+# maps, which joblib shares with the workers. The best parameters are then
+# refit as an RBF SVC on x, so the model is used like any other.
+#
+#       gamma='scale' is resolved once on all the rows instead of on the
+# training rows of each fold, as a standardized x has a variance of 1.
+#
+# -----------------------------------------------------------------------------
+def kernelfit(traindf, features, param_grid=PARAMGRID, workers=-1, verbose=3, maxbytes=MAXGRAM):
+    x, y, mean, var = standardize(traindf, features)
+    group = PredefinedSplit(traindf['File'].tolist())
+
+    # Group the candidates by gamma
+    grids = {}
+    for params in ParameterGrid(param_grid):
+        params = dict(params)
+        gamma = resolvegamma(params.pop('gamma', 'scale'), x)
+        params.pop('kernel', None)
+        grids.setdefault(gamma, []).append({name: [value] for name, value in params.items()})
+
+    best = None
+    results = {'params': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        shape = (x.shape[0], x.shape[0])
+        if x.shape[0] ** 2 * 8 > maxbytes:
+            d2 = np.lib.format.open_memmap(os.path.join(tmp, 'd2.npy'), 'w+', np.float64, shape)
+            K = np.lib.format.open_memmap(os.path.join(tmp, 'gram.npy'), 'w+', np.float64, shape)
+        else:
+            d2 = np.empty(shape)
+            K = np.empty(shape)
+        sqdistances(x, d2)
+        for gamma, grid in grids.items():
+            gram(d2, gamma, K)
+            grid_search = GridSearchCV(SVC(kernel='precomputed'), grid, refit=False, verbose=verbose,
+                                       n_jobs=workers, pre_dispatch=8, cv=group)
+            grid_search.fit(K, y)
+            for name, values in grid_search.cv_results_.items():
+                if name == 'params':
+                    results['params'] += [dict(params, gamma=gamma, kernel='rbf') for params in values]
+                elif not name.startswith('param_') and name != 'rank_test_score':
+                    results.setdefault(name, []).extend(values)
+            if best is None or grid_search.best_score_ > best[1]:
+                best = (dict(grid_search.best_params_, gamma=gamma, kernel='rbf'), grid_search.best_score_)
+        del d2, K
+
+    params, score = best
+    return KernelSearch(params, score, SVC(**params).fit(x, y), cvresults(results)), mean, var
+
+
+# -----------------------------------------------------------------------------
+# cvresults
+#
+# Description:
+#       This function turns the results merged over the gammas of kernelfit
+# into the cv_results_ of GridSearchCV: arrays per key, a masked param_<name>
+# array per parameter and the rank of every candidate.
+#
+# -----------------------------------------------------------------------------
+def cvresults(results):
+    cv = {name: np.asarray(values) for name, values in results.items() if name != 'params'}
+    names = sorted({name for params in results['params'] for name in params})
+    for name in names:
+        cv['param_' + name] = np.ma.MaskedArray([params.get(name) for params in results['params']],
+                                                mask=[name not in params for params in results['params']],
+                                                dtype=object)
+    cv['params'] = results['params']
+    cv['rank_test_score'] = rankdata(-cv['mean_test_score'], method='min').astype(np.int32)
+    return cv
+
+
+# -----------------------------------------------------------------------------
+# approxmodel / approxfit
+#
+# Description:
+#       The approximate kernel models map the features with an RBF kernel
+# approximation, Nystroem ('nystroem') or random Fourier features ('rff'),
+# and classify the mapped features with a balanced logistic regression. The
+# prediction cost depends on COMPONENTS only, not on the number of training
+# windows like the support vectors of the SVC. gamma defaults to
+# 1 / features, which is 'scale' for standardized features.
+#
+#       approxfit searches param_grid (names prefixed with 'kernel__' or
+# 'linear__') like fit does and returns the same results.
+#
+# -----------------------------------------------------------------------------
+def approxmodel(method, features, components=COMPONENTS):
+    gamma = 1.0 / features
+    if method == 'nystroem':
+        kernel = Nystroem(kernel='rbf', gamma=gamma, n_components=components, random_state=0)
+    elif method == 'rff':
+        kernel = RBFSampler(gamma=gamma, n_components=components, random_state=0)
+    else:
+        raise ValueError('unknown approximate model {}'.format(method))
+    return Pipeline([('kernel', kernel),
+                     ('linear', LogisticRegression(class_weight='balanced', max_iter=1000))])
+
+
+def approxfit(traindf, features, param_grid=APPROXGRID, method='nystroem', workers=-1, verbose=3):
+    x, y, mean, var = standardize(traindf, features)
+    group = PredefinedSplit(traindf['File'].tolist())
+    clf = GridSearchCV(estimator(method, x.shape[1]), param_grid, refit=True, verbose=verbose, n_jobs=workers,
+                       pre_dispatch=8, cv=group)
+    clf.fit(x, y)
+    return clf, mean, var
+
+
+def train(traindf, features, model='svc', param_grid=None, workers=-1, verbose=3):
+    if model == 'svc':
+        return fit(traindf, features, PARAMGRID if param_grid is None else param_grid, workers, verbose)
+    return approxfit(traindf, features, APPROXGRID if param_grid is None else param_grid, model, workers, verbose)
+
+
+def fitmodel(model, x, y, train):
+    return clone(model).fit(x[train], y[train])
+
+
+# -----------------------------------------------------------------------------
+# compare
+#
+# Description:
+#       This function compares models on the PredefinedSplit folds. Every
+# (model, fold) pair is fitted in parallel; the latencies are then measured
+# one model at a time in this process: a batch prediction of the whole test
+# fold and repeated predictions of a single window, the case of the server.
+# models maps a name to an unfitted estimator.
+#
+# Returns a DataFrame of the mean over the folds per model.
+#
+# -----------------------------------------------------------------------------
+def compare(traindf, features, models, workers=-1, repeats=200):
+    x, y, mean, var = standardize(traindf, features)
+    folds = list(PredefinedSplit(traindf['File'].tolist()).split())
+    names = list(models)
+    fitted = Parallel(n_jobs=workers)(delayed(fitmodel)(models[name], x, y, train)
+                                      for name in names for train, test in folds)
+
+    rows = []
+    for k, clf in enumerate(fitted):
+        name = names[k // len(folds)]
+        test = folds[k % len(folds)][1]
+        start = time.perf_counter()
+        accuracy = np.mean(clf.predict(x[test]) == y[test])
+        batch = (time.perf_counter() - start) / len(test)
+        single = []
+        for i in test[:repeats]:
+            start = time.perf_counter()
+            clf.predict(x[i:i + 1])
+            single.append(time.perf_counter() - start)
+        rows.append({'model': name,
+                     'accuracy': accuracy,
+                     'batch [us/window]': batch * 1e6,
+                     'single [us]': np.median(single) * 1e6,
+                     'support vectors': len(clf.support_) if hasattr(clf, 'support_') else np.nan})
+    return pd.DataFrame(rows).groupby('model', sort=False).mean()
+
+
+def evaluate(truth, predict):
+    tn, fp, fn, tp = confusion_matrix(truth, predict, labels=["Fatigued", "Not Fatigued"]).ravel()
+    print(tn, tp, fn, fp)
+    sensitivity = tn / (tn + fp)
+    specificity = tp / (tp + fn)
+    pospred = tn / (tn + fn)
+    negpred = tp / (tp + fp)
+    return sensitivity, specificity, pospred, negpred
+
+
+# -----------------------------------------------------------------------------
+# score
+#
+# Description:
+#       This function evaluates a classifier on a feature DataFrame and
+# returns the sensitivity, specificity, predictive values and their
+# performance (the geometric mean of sensitivity and specificity).
+#
+# -----------------------------------------------------------------------------
+def score(clf, df, features, mean, var):
+    x = ((df.loc[:, list(features)] - mean) / var).to_numpy()
+    sens, spec, posp, negp = evaluate(df.loc[:, 'Class'].to_numpy(), clf.predict(x))
+    return {'sensitivity': sens,
+            'specificity': spec,
+            'positive predictive': posp,
+            'negative predictive': negp,
+            'performance': (sens * spec) ** (1 / 2)}
+
+
+def save(model, mean, var, path='.', params=None):
+    em.save(os.path.join(path, em.MODELFILE), model, mean, var, list(mean.index), params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the mental fatigue classifier without the GUI.')
+    parser.add_argument('data', help='folder of recordings, eegcorpus folder or saved trainlist.csv')
+    parser.add_argument('--out', default='.', help='folder for the model and the statistics')
+    parser.add_argument('--window', type=int, default=ef.WINDOW)
+    parser.add_argument('--lowcut', type=float, default=ef.LOWCUT)
+    parser.add_argument('--highcut', type=float, default=ef.HIGHCUT)
+    parser.add_argument('--pulsemax', type=float, default=ef.PULSEMAX)
+    parser.add_argument('--usemark', action='store_true')
+    parser.add_argument('--features', nargs='+', default=ef.FEATURENAMES, help='included features')
+    parser.add_argument('--exclude', nargs='+', default=[], help='excluded features')
+    parser.add_argument('--model', choices=MODELS, default='svc',
+                        help='exact RBF SVC or an approximate kernel with a linear classifier')
+    parser.add_argument('--grid', type=json.loads, default=None, help='GridSearchCV param_grid as JSON')
+    parser.add_argument('--pregrid', type=json.loads, default=None,
+                        help='pre-processing parameters to search jointly, as JSON (needs a folder)')
+    parser.add_argument('--factor', type=int, default=FACTOR, help='successive halving factor, 1 for all')
+    parser.add_argument('--precomputed', action='store_true',
+                        help='fit the folds on one precomputed Gram matrix per gamma')
+    parser.add_argument('--compare', action='store_true',
+                        help='report the accuracy and latency of the exact and approximate models')
+    parser.add_argument('--workers', type=int, default=-1, help='grid search jobs, -1 for all cores')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the feature cache')
+    parser.add_argument('--skip-failed', action='store_true',
+                        help='train without the recordings that fail to load instead of stopping')
+    args = parser.parse_args()
+    if args.precomputed and args.model != 'svc':
+        parser.error('--precomputed only applies to --model svc')
+    if args.pregrid is not None and not os.path.isdir(args.data):
+        parser.error('--pregrid needs a folder of recordings, not a feature file')
+
+    params = {'fs': ef.FS, 'window': args.window, 'lowcut': args.lowcut, 'highcut': args.highcut,
+              'pulsemax': args.pulsemax, 'usemark': args.usemark}
+    features = [feat for feat in args.features if feat not in args.exclude]
+    if args.grid is None:
+        args.grid = PARAMGRID if args.model == 'svc' else APPROXGRID
+    grid = {name: value if isinstance(value, list) else [value] for name, value in args.grid.items()}
+    cache = None if args.no_cache else ec.FeatureCache()
+    os.makedirs(args.out, exist_ok=True)
+
+    start = time.time()
+    failed = {}
+    if args.pregrid is not None:
+        pregrid = dict({name: [value] for name, value in params.items()},
+                       **{name: value if isinstance(value, list) else [value] for name, value in args.pregrid.items()})
+        params, best, traindf, history = search(args.data, features, pregrid, grid, args.factor, args.workers, cache,
+                                                model=args.model, failed=failed)
+        grid = {name: [value] for name, value in best.items()}
+        print('best pre-processing: {}'.format(params))
+        with open(os.path.join(args.out, 'searchhistory.json'), 'w') as f:
+            json.dump(history, f, indent=1, default=float)
+    elif os.path.isdir(args.data):
+        traindf = ingest(args.data, params, cache=cache, failed=failed)
+    else:
+        traindf = readfeatures(args.data)
+    if failed and not args.skip_failed:
+        sys.exit('eegtrain: failed to ingest {} recordings, rerun with --skip-failed to train without them: {}'
+                 .format(len(failed), '; '.join('{} ({})'.format(*item) for item in failed.items())))
+    print('{} windows of {} files in {:.1f} s'.format(len(traindf), args.data, time.time() - start))
+
+    if args.precomputed:
+        clf, mean, var = kernelfit(traindf, features, grid, args.workers)
+    else:
+        clf, mean, var = train(traindf, features, args.model, grid, args.workers)
+    print(clf.best_estimator_)
+    stats = {'data': args.data,
+             'params': params if os.path.isdir(args.data) else None,
+             'search': args.pregrid is not None,
+             'features': features,
+             'windows': len(traindf),
+             'failed': failed,
+             'best params': clf.best_params_,
+             'validation': clf.best_score_,
+             'train': score(clf, traindf, features, mean, var),
+             'seconds': time.time() - start}
+
+    save(clf.best_estimator_, mean, var, args.out, stats['params'])
+    traindf.to_csv(os.path.join(args.out, 'trainlist.csv'))
+    with open(os.path.join(args.out, STATSFILE), 'w') as f:
+        json.dump(stats, f, indent=1, default=float)
+    for name, value in stats['train'].items():
+        print('{}:\t{:.4f}'.format(name, value))
+    print('validation:\t{:.4f}'.format(clf.best_score_))
+
+    if args.compare:
+        svc = clf.best_estimator_ if args.model == 'svc' else SVC(**{k: v[0] for k, v in PARAMGRID.items()})
+        models = {'svc': svc}
+        for method in MODELS[1:]:
+            models[method] = clf.best_estimator_ if args.model == method else approxmodel(method, len(features))
+        report = compare(traindf, features, models, args.workers)
+        report.to_csv(os.path.join(args.out, 'compare.csv'))
+        print(report.to_string(float_format='{:.4f}'.format))
+    sys.exit(0)
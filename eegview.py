@@ -0,0 +1,270 @@
+# |ECE 499: EEG View|----------------------------------------------------------
+#
+# Project: Brain Assessment for Mental Fatigue
+# Program: View Data Storage
+#
+# Description:
+#      Holds the processing stages of one recording for the View Data page.
+# Every stage is a (channels x samples) slice of one contiguous float32
+# array, so plotting a stage does not copy it. Only the raw, uV and filtered
+# stages are computed up front; the final stage, the EEG bands and the
+# spectra are computed on first request and remembered, while a background
+# thread computes them ahead in the order the page cycles through them.
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import collections
+import threading
+
+import numpy as np
+
+import eegfeatures as ef
+
+from scipy import signal
+
+# |CONSTANTS|------------------------------------------------------------------
+STAGES = ['Raw', 'uV', 'Filter', ''] + ef.BANDS                         # Time domain plots
+SPECTRA = [''] + ef.BANDS                                               # Frequency domain plots
+BASE = ['Raw', 'uV', 'Filter']                                          # Stages computed up front
+FACTOR = 4              # Samples merged per bucket between pyramid levels
+BANDMODES = ['filterbank', 'subtractive']                               # Band split methods of eegfeatures.getband
+
+
+# -----------------------------------------------------------------------------
+# Pyramid
+#
+# Description:
+#       Min/max envelope of uniformly sampled signals (channels x samples)
+# for drawing. Level k holds the minimum and the maximum of every FACTOR**k
+# samples, so a window of any width can be drawn with about two points per
+# pixel. The levels add two thirds of the signal size.
+#
+# -----------------------------------------------------------------------------
+class Pyramid:
+    def __init__(self, y, dx):
+        self.y = y
+        self.dx = dx
+        self.levels = [(y, y)]
+        while self.levels[-1][0].shape[-1] > 1:
+            lo, hi = self.levels[-1]
+            edges = np.arange(0, lo.shape[-1], FACTOR)
+            self.levels.append((np.minimum.reduceat(lo, edges, axis=-1),
+                                np.maximum.reduceat(hi, edges, axis=-1)))
+
+    def limits(self):
+        lo, hi = self.levels[-1]
+        return lo.min(), hi.max()
+
+    # -------------------------------------------------------------------------
+    # window
+    #
+    # Description:
+    #       This method returns x (points) and y (channels x points) of the
+    # samples between x0 and x1, decimated to about two points per pixel.
+    # Each bucket is drawn as its minimum followed by its maximum.
+    #
+    # -------------------------------------------------------------------------
+    def window(self, x0, x1, pixels):
+        size = self.y.shape[-1]
+        i0 = min(max(int(np.floor(x0 / self.dx)), 0), size)
+        i1 = min(max(int(np.ceil(x1 / self.dx)) + 1, i0), size)
+        k = 0
+        while k + 1 < len(self.levels) and (i1 - i0) // FACTOR ** (k + 1) >= pixels:
+            k += 1
+        if k == 0:
+            return np.arange(i0, i1) * self.dx, self.y[:, i0:i1]
+
+        bucket = FACTOR ** k
+        b0 = i0 // bucket
+        b1 = -(-i1 // bucket)
+        lo, hi = self.levels[k]
+        y = np.empty(lo.shape[:-1] + (2 * (b1 - b0),), dtype=lo.dtype)
+        y[:, 0::2] = lo[:, b0:b1]
+        y[:, 1::2] = hi[:, b0:b1]
+        x = np.repeat(np.arange(b0, b1) * bucket * self.dx, 2)
+        return x, y
+
+
+# -----------------------------------------------------------------------------
+# StageView
+#
+# Description:
+#       Pre-processes a recording with eegfeatures.viewstages and keeps the
+# stages in a (stages x channels x samples) float32 array. The bands are
+# split with eegfeatures.getband in mode: a 'filterbank' band depends on the
+# final stage only (band -> final -> filter), a 'subtractive' band on the
+# final stage and the lower bands, so stage() and spectrum() compute their
+# inputs first. One lock per stage lets the
+# prefetch thread and the GUI ask for the same stage without computing it
+# twice. A stage that fails in the prefetch thread keeps its exception, so a
+# plot waiting on it can report it instead of waiting forever.
+#
+# -----------------------------------------------------------------------------
+class StageView:
+    def __init__(self, data, fs=ef.FS, lowcut=ef.LOWCUT, highcut=ef.HIGHCUT, pulsemax=ef.PULSEMAX,
+                 usemark=False, dtype=np.float32, mode='filterbank'):
+        if mode not in BANDMODES:
+            raise ValueError('mode must be one of {}, not {!r}'.format(BANDMODES, mode))
+        stages = ef.viewstages(data, fs, lowcut, highcut, pulsemax, usemark, final=False)
+        self.fs = fs
+        self.mode = mode
+        self.lowcut = lowcut
+        self.highcut = highcut
+        self.size = stages['Total'].shape[0]
+        self.marker = stages['Marker']
+        self.total = stages['Total'].astype(dtype)
+        self.time = np.arange(self.size) / fs
+        self.freq = np.linspace(0.0, fs / 2, self.size // 2)
+
+        # Pages of the lazy stages are only committed once they are computed
+        self.signals = np.empty((len(STAGES), len(ef.CHANNELS), self.size), dtype=dtype)
+        self.ready = [False] * len(STAGES)
+        for name in BASE:
+            i = STAGES.index(name)
+            self.signals[i] = stages[name]
+            self.ready[i] = True
+
+        self.spectra = np.empty((len(SPECTRA), len(ef.CHANNELS), self.size // 2), dtype=dtype)
+        self.spectraready = [False] * len(SPECTRA)
+
+        self.pyramids = {}
+
+        self.locks = [threading.Lock() for _ in STAGES]
+        self.spectralocks = [threading.Lock() for _ in SPECTRA]
+        self.errors = {}
+        self.pending = collections.deque()
+        self.wake = threading.Condition()
+        self.closed = False
+        self.worker = None
+
+    # -------------------------------------------------------------------------
+    # stage
+    #
+    # Description:
+    #       This method returns stage i (channels x samples) as a view,
+    # computing it the first time it is requested.
+    #
+    # -------------------------------------------------------------------------
+    def stage(self, i):
+        with self.locks[i]:
+            if not self.ready[i]:
+                name = STAGES[i]
+                if name == '':
+                    [b, a] = ef.bandpass(self.lowcut, self.highcut, self.fs)
+                    self.signals[i] = signal.filtfilt(b, a, self.stage(STAGES.index('Filter')), axis=-1)
+                else:
+                    band = ef.BANDS.index(name)
+                    rest = self.stage(STAGES.index(''))
+                    if self.mode == 'subtractive':
+                        rest = rest - sum(self.stage(STAGES.index(lower)) for lower in ef.BANDS[:band])
+                    self.signals[i] = ef.getband(rest, band, self.fs, mode=self.mode)
+                self.ready[i] = True
+        return self.signals[i]
+
+    # -------------------------------------------------------------------------
+    # spectrum
+    #
+    # Description:
+    #       This method returns the periodogram of spectrum i
+    # (channels x frequencies), computing it the first time it is requested.
+    #
+    # -------------------------------------------------------------------------
+    def spectrum(self, i):
+        with self.spectralocks[i]:
+            if not self.spectraready[i]:
+                self.spectra[i] = ef.spectrum(self.stage(STAGES.index(SPECTRA[i])), self.fs)[1]
+                self.spectraready[i] = True
+        return self.spectra[i]
+
+    # -------------------------------------------------------------------------
+    # pyramid
+    #
+    # Description:
+    #       This method returns the Pyramid of stage i, or of spectrum i with
+    # spectrum=True, building it the first time it is requested.
+    #
+    # -------------------------------------------------------------------------
+    def pyramid(self, i, spectrum=False):
+        if (i, spectrum) not in self.pyramids:
+            if spectrum:
+                dx = self.freq[1] if self.freq.size > 1 else 1.0
+                self.pyramids[(i, spectrum)] = Pyramid(self.spectrum(i), dx)
+            else:
+                self.pyramids[(i, spectrum)] = Pyramid(self.stage(i), 1 / self.fs)
+        return self.pyramids[(i, spectrum)]
+
+    def stageready(self, i):
+        return self.ready[i]
+
+    def spectrumready(self, i):
+        return self.spectraready[i]
+
+    def error(self, i, spectrum=False):
+        return self.errors.get((i, spectrum))
+
+    # -------------------------------------------------------------------------
+    # prefetch
+    #
+    # Description:
+    #       This method starts the background thread on a list of
+    # (i, spectrum) pairs. By default it follows the cycle of the View Data
+    # page: the stage and the spectrum shown by the first click, then the
+    # second click, and so on.
+    #
+    # -------------------------------------------------------------------------
+    def prefetch(self, order=None):
+        if order is None:
+            order = []
+            for k in range(max(len(STAGES), len(SPECTRA))):
+                order += [(k % len(STAGES), False), (k % len(SPECTRA), True)]
+        with self.wake:
+            self.pending.extend(order)
+            self.wake.notify()
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    # -------------------------------------------------------------------------
+    # request
+    #
+    # Description:
+    #       This method moves a stage (or a spectrum) to the front of the
+    # prefetch queue, for a plot that is waiting on it. A stage that already
+    # failed is not queued again; its exception is returned instead.
+    #
+    # -------------------------------------------------------------------------
+    def request(self, i, spectrum=False):
+        err = self.error(i, spectrum)
+        if err is not None:
+            return err
+        with self.wake:
+            self.pending.appendleft((i, spectrum))
+            self.wake.notify()
+        return None
+
+    def run(self):
+        while True:
+            with self.wake:
+                while not self.pending and not self.closed:
+                    self.wake.wait()
+                if self.closed:
+                    return
+                i, spectrum = self.pending.popleft()
+            if (i, spectrum) in self.errors:
+                continue
+            try:
+                if spectrum:
+                    self.spectrum(i)
+                else:
+                    self.stage(i)
+            except Exception as err:
+                self.errors[(i, spectrum)] = err
+
+    def close(self, wait=False):
+        with self.wake:
+            self.closed = True
+            self.pending.clear()
+            self.wake.notify()
+        if wait and self.worker is not None:
+            self.worker.join()
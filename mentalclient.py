@@ -1,7 +1,61 @@
 import socket
+import sys
 import pandas as pd
 import time
-from mentalfatigue import assess
+
+import eegreader as er
+import mentalprotocol as mp
+
+# Send whole samples as binary frames; old servers only speak text lines
+BINARY = '--text' not in sys.argv[1:]
+# Stream a raw recording instead of the pre-computed features: --raw file.csv
+# (or a recording of an eegcorpus: --raw corpus/file.npy)
+RAW = sys.argv[sys.argv.index('--raw') + 1] if '--raw' in sys.argv[1:] else None
+CHUNK = 25              # Raw samples per frame (0.1 s at 250 Hz)
+
+
+def sendtext(sock, sample):
+    for j, val in enumerate(sample):
+        message = "{}\t{}\n".format(j, val).encode('utf-8')
+        sock.sendall(message)
+        time.sleep(1/64)
+    time.sleep(4)
+    # Look for the response
+    amount_received = 0
+    amount_expected = len('Fatigued'.encode('utf-8'))
+
+    while amount_received < amount_expected:
+        data = sock.recv(32)
+        amount_received += len(data)
+        print("Results: {}".format(data.decode('utf-8')))
+
+
+def sendraw(sock, filename):
+    eeg = er.load(filename)
+    sent = 0
+    for i in range(0, eeg.shape[0], CHUNK):
+        sock.sendall(mp.packraw(eeg[i:i + CHUNK]))
+        sent += eeg[i:i + CHUNK].shape[0]
+        time.sleep(CHUNK / 250)
+    return sent
+
+
+def readresult(sock):
+    if not sock.recv(1, socket.MSG_PEEK):
+        return False                                                    # The server closed the connection
+    kind, payload = mp.recvframe(sock)
+    if kind == mp.ERROR:
+        print("Error: {}".format(bytes(payload).decode('utf-8')))
+    else:
+        print("Results: {}".format(bytes(payload).decode('utf-8')))
+    return True
+
+
+def sendframe(sock, sample):
+    sock.sendall(mp.packfeatures(sample))
+    readresult(sock)
+
+
 # Create a TCP/IP socket
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
@@ -10,24 +64,27 @@ server_address = (socket.gethostname(), 10000)
 print('connecting to {} port {}'.format(*server_address))
 sock.connect(server_address)
 
-test = pd.read_csv('trainlist.csv')
-test = test.iloc[:, 1:-2]
-
 try:
+    if BINARY or RAW:
+        sock.sendall(mp.greeting())
+        if bytes(mp.recvexactly(sock, len(mp.MAGIC) + 1))[:len(mp.MAGIC)] != mp.MAGIC:
+            raise ConnectionError('server does not speak the binary protocol')
+    if RAW:
+        # The number of windows depends on the server's window and fs, so
+        # every result is read until the server closes the connection
+        sendraw(sock, RAW)
+        sock.shutdown(socket.SHUT_WR)
+        while readresult(sock):
+            pass
+        sys.exit(0)
+
+    test = pd.read_csv('trainlist.csv')
+    test = test.iloc[:, 1:-2]
     for i in range(test.shape[0]):
-        for j, val in enumerate(test.iloc[i].to_list()):
-            message = "{}\t{}\n".format(j, val).encode('utf-8')
-            sock.sendall(message)
-            time.sleep(1/64)
-        time.sleep(4)
-        # Look for the response
-        amount_received = 0
-        amount_expected = len('Fatigued'.encode('utf-8'))
-
-        while amount_received < amount_expected:
-            data = sock.recv(32)
-            amount_received += len(data)
-            print("Results: {}".format(data.decode('utf-8')))
+        if BINARY:
+            sendframe(sock, test.iloc[i].to_numpy())
+        else:
+            sendtext(sock, test.iloc[i].to_list())
 finally:
     print('closing socket')
-    sock.close()
\ No newline at end of file
+    sock.close()
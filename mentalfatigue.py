@@ -1,28 +1,267 @@
 # |MODULES|--------------------------------------------------------------------
 import sys
+import collections
 import os.path
-MODULE_PATH = os.path.dirname(__file__)
-import pandas as pd
 import pickle as pk
+import threading
+import time
+import warnings
+MODULE_PATH = os.path.dirname(__file__)
+import numpy as np
+
+import eegmodel as em
+
+# The loaded model, replaced as a whole so a prediction never mixes two models
+State = collections.namedtuple('State', ['clf', 'mean', 'var', 'features', 'params'])
+
+# Model files written before the eegmodel bundle
+LEGACY = ['finalized_model.sav', 'mean.sav', 'var.sav']
+CONVERT = 'python eegmodel.py convert {} --out {}'.format(' '.join(LEGACY), em.MODELFILE)
+
+
+# |PREDICTOR|------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Predictor
+#
+# Description:
+#       Keeps the trained classifier and the normalization statistics in
+# memory so that each prediction does not unpickle the model from disk. The
+# eegmodel bundle is memory-mapped and re-read only when its modification
+# time or size changes. With native (the default) an RBF SVC is evaluated by
+# eegmodel.RbfSVC, so scikit-learn is only imported for other models.
+#
+#       The model, its statistics and feature names are one State tuple that
+# a reload swaps in at once; every prediction reads it once, so a reload on
+# another thread cannot pair the new statistics with the old model.
+#
+#       A folder with only the LEGACY .sav files is still loaded, with a
+# warning naming the command that converts them into a bundle.
+#
+# -----------------------------------------------------------------------------
+class Predictor:
+    def __init__(self, path=MODULE_PATH, interval=1.0, native=True):
+        self.path = path
+        self.interval = interval
+        self.native = native
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.checked = 0.0
+        self.state = None
+        self.reload()
+
+    @property
+    def clf(self):
+        return self.state.clf
+
+    @property
+    def mean(self):
+        return self.state.mean
+
+    @property
+    def var(self):
+        return self.state.var
+
+    @property
+    def features(self):
+        return self.state.features
+
+    @property
+    def params(self):
+        return self.state.params
+
+    # -------------------------------------------------------------------------
+    # getstamp
+    #
+    # Description:
+    #       These methods return the model files in use, the bundle unless
+    # only the LEGACY files exist, and their (name, mtime, size).
+    #
+    # -------------------------------------------------------------------------
+    def files(self):
+        if os.path.exists(os.path.join(self.path, em.MODELFILE)):
+            return [em.MODELFILE]
+        if all(os.path.exists(os.path.join(self.path, name)) for name in LEGACY):
+            return LEGACY
+        raise FileNotFoundError('no {} in {}; old .sav models are converted with: {}'.format(
+            em.MODELFILE, self.path, CONVERT))
+
+    def getstamp(self):
+        stamp = []
+        for name in self.files():
+            st = os.stat(os.path.join(self.path, name))
+            stamp.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    # -------------------------------------------------------------------------
+    # reload
+    #
+    # Description:
+    #       This method loads the model and the statistics from disk.
+    #
+    # -------------------------------------------------------------------------
+    def reload(self):
+        with self.lock:
+            stamp = self.getstamp()
+            if stamp[0][0] == em.MODELFILE:
+                bundle = em.load(os.path.join(self.path, em.MODELFILE), native=self.native)
+                self.state = State(bundle.model, bundle.mean, bundle.std, bundle.features, bundle.params)
+            else:
+                self.state = self.loadlegacy()
+            self.stamp = stamp
+            self.checked = time.monotonic()
+
+    # -------------------------------------------------------------------------
+    # loadlegacy
+    #
+    # Description:
+    #       This method loads the LEGACY pickles: the model and the mean and
+    # standard deviation, as pandas Series indexed by feature name or as
+    # lists of all eegfeatures.FEATURENAMES.
+    #
+    # -------------------------------------------------------------------------
+    def loadlegacy(self):
+        warnings.warn('{} uses the deprecated .sav model files; convert them with: {}'.format(self.path, CONVERT),
+                      FutureWarning)
+        clf, mean, var = [pk.load(open(os.path.join(self.path, name), 'rb')) for name in LEGACY]
+        return State(clf, np.asarray(mean, dtype=np.float64), np.asarray(var, dtype=np.float64),
+                     em.featurenames(mean), None)
+
+    # -------------------------------------------------------------------------
+    # refresh
+    #
+    # Description:
+    #       This method reloads the model if the files changed on disk. The
+    # files are checked at most once every interval seconds.
+    #
+    # -------------------------------------------------------------------------
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return
+        self.checked = now
+        try:
+            stamp = self.getstamp()
+        except OSError:
+            return                                                      # Keep the model mid-save
+        if stamp != self.stamp:
+            self.reload()
+
+    # -------------------------------------------------------------------------
+    # align
+    #
+    # Description:
+    #       This method converts the input into a float array aligned to the
+    # features the model was trained on. Labelled inputs are aligned by name;
+    # arrays must hold either those features in order or all of
+    # eegfeatures.FEATURENAMES.
+    #
+    # -------------------------------------------------------------------------
+    def align(self, x, state=None):
+        features = (state or self.state).features
+        if hasattr(x, 'reindex'):                                       # pandas Series or DataFrame
+            if x.ndim == 1:
+                x = x.reindex(features)
+            else:
+                x = x.reindex(columns=features)
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim and x.shape[-1] != len(features):
+            import eegfeatures as ef                                    # Only needed for whole feature vectors
+
+            if x.shape[-1] != len(ef.FEATURENAMES):
+                raise ValueError('expected {} features ({} ...) or all {}, got {}'.format(
+                    len(features), ', '.join(features[:3]), len(ef.FEATURENAMES), x.shape[-1]))
+            x = x[..., [ef.FEATURENAMES.index(name) for name in features]]
+        return x
+
+    # -------------------------------------------------------------------------
+    # prepare
+    #
+    # Description:
+    #       This method converts the input into a normalized 2-D matrix.
+    #
+    # -------------------------------------------------------------------------
+    def prepare(self, x, state):
+        x = self.align(x, state)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        x = x - state.mean
+        x /= state.var
+        return x
+
+    # -------------------------------------------------------------------------
+    # predict_one
+    #
+    # Description:
+    #       This method classifies a single feature vector.
+    #
+    # -------------------------------------------------------------------------
+    def predict_one(self, x):
+        return self.predict_batch(x)[0]
+
+    # -------------------------------------------------------------------------
+    # predict_batch
+    #
+    # Description:
+    #       This method classifies every row of a feature matrix.
+    #
+    # -------------------------------------------------------------------------
+    def predict_batch(self, x):
+        self.refresh()
+        state = self.state
+        return state.clf.predict(self.prepare(x, state))
+
+    # -------------------------------------------------------------------------
+    # score_batch
+    #
+    # Description:
+    #       This method returns the predicted classes and the decision
+    # function scores for every row of a feature matrix. For a two class
+    # model the classes are taken from the sign of the scores so the kernel
+    # is only evaluated once.
+    #
+    # -------------------------------------------------------------------------
+    def score_batch(self, x):
+        self.refresh()
+        state = self.state
+        x = self.prepare(x, state)
+        scores = state.clf.decision_function(x)
+        if scores.ndim == 1:
+            predict = state.clf.classes_[(scores > 0).astype(int)]
+        else:
+            predict = state.clf.predict(x)
+        return predict, scores
+
+
+predictor = None
+lock = threading.Lock()
+
+
+def getpredictor():
+    global predictor
+    if predictor is None:
+        with lock:
+            if predictor is None:
+                predictor = Predictor()
+    return predictor
 
 
 def assess(x):
-    clf = pk.load(open(os.path.join(MODULE_PATH,'finalized_model.sav'), 'rb'))
-    mean = pk.load(open(os.path.join(MODULE_PATH,'mean.sav'), 'rb'))
-    var = pk.load(open(os.path.join(MODULE_PATH,'var.sav'), 'rb'))
-    x = (x - mean)/var
-    x = x.to_numpy().reshape(1, -1)
-    return clf.predict(x)[0]
+    return getpredictor().predict_one(x)
+
+
+def assess_batch(x):
+    return getpredictor().score_batch(x)
 
 
 if __name__ == "__main__":
+    import pandas as pd
+
     test = pd.read_csv('trainlist.csv')
     y = test.loc[:, "Class"].to_numpy()
     test = test.iloc[:, 1:-2]
-    for i in range(test.shape[0]):
-        #for j, val in enumerate(test.iloc[i].to_list()):
-        #    print("{}\t{}\n".format(j, val))
-        print(assess(test.iloc[i]))
+    predict, scores = assess_batch(test)
+    for label, score in zip(predict, scores):
+        print("{}\t{}".format(label, '\t'.join('{:.4f}'.format(value) for value in np.atleast_1d(score))))
 
     # clf = pk.load(open('finalized_model.sav', 'rb'))
     # mean = pk.load(open('mean.sav', 'rb'))
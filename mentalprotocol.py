@@ -0,0 +1,109 @@
+# |Mental Protocol|------------------------------------------------------------
+#
+# Description:
+#      Binary framing shared by mentalclient and mentalserver. A binary client
+# opens the connection with MAGIC followed by one version byte and the server
+# answers with the same greeting. Every message after that is a frame made of
+# a little-endian header (kind: uint8, length: uint32) and length bytes of
+# payload. Clients that do not send the greeting keep using the original
+# "{index}\t{value}\n" text lines.
+#
+# -----------------------------------------------------------------------------
+
+# |MODULES|--------------------------------------------------------------------
+import struct
+
+import numpy as np
+
+# |CONSTANTS|------------------------------------------------------------------
+MAGIC = b'BAMF'
+VERSION = 1
+HEADER = struct.Struct('<BI')
+MAXFRAME = 1 << 20
+
+# Frame kinds
+FEATURES = 1            # Client -> Server: float64 feature vector
+RESULT = 2              # Server -> Client: utf-8 class label
+ERROR = 3               # Server -> Client: utf-8 error message
+RAW = 4                 # Client -> Server: float32 raw samples (Marker, EEG1..EEG4)
+
+FEATURE_DTYPE = np.dtype('<f8')
+RAW_DTYPE = np.dtype('<f4')
+RAW_COLUMNS = 5
+
+
+def greeting(version=VERSION):
+    return MAGIC + bytes([version])
+
+
+def packframe(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def packfeatures(x):
+    return packframe(FEATURES, np.ascontiguousarray(x, dtype=FEATURE_DTYPE).tobytes())
+
+
+def unpackfeatures(payload):
+    if len(payload) % FEATURE_DTYPE.itemsize:
+        raise ValueError('feature frame of {} bytes is not a whole number of values'.format(len(payload)))
+    # Zero-copy view on the received buffer
+    return np.frombuffer(payload, dtype=FEATURE_DTYPE)
+
+
+def packraw(chunk):
+    return packframe(RAW, np.ascontiguousarray(chunk, dtype=RAW_DTYPE).tobytes())
+
+
+def unpackraw(payload):
+    if len(payload) % RAW_DTYPE.itemsize:
+        raise ValueError('raw frame of {} bytes is not a whole number of values'.format(len(payload)))
+    raw = np.frombuffer(payload, dtype=RAW_DTYPE)
+    if raw.size % RAW_COLUMNS:
+        raise ValueError('raw frame of {} values is not a whole number of samples'.format(raw.size))
+    return raw.reshape(-1, RAW_COLUMNS)
+
+
+def checkheader(header):
+    kind, size = HEADER.unpack(header)
+    if size > MAXFRAME:
+        raise ValueError('frame of {} bytes exceeds the {} byte limit'.format(size, MAXFRAME))
+    return kind, size
+
+
+# -----------------------------------------------------------------------------
+# readframe
+#
+# Description:
+#       This coroutine reads one whole frame from an asyncio stream.
+#
+# -----------------------------------------------------------------------------
+async def readframe(reader):
+    kind, size = checkheader(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(size)
+    return kind, memoryview(payload)
+
+
+# -----------------------------------------------------------------------------
+# recvexactly / recvframe
+#
+# Description:
+#       These functions read from a blocking socket until the requested
+# number of bytes, or one whole frame, has arrived.
+#
+# -----------------------------------------------------------------------------
+def recvexactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError('connection closed mid-frame')
+        received += n
+    return buf
+
+
+def recvframe(sock):
+    kind, size = checkheader(bytes(recvexactly(sock, HEADER.size)))
+    return kind, memoryview(recvexactly(sock, size))
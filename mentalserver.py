@@ -1,39 +1,510 @@
+# |MODULES|--------------------------------------------------------------------
+import asyncio
+import collections
 import socket
-from mentalfatigue import assess
-# Create a TCP/IP socket
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-# Bind the socket to the port
-server_address = (socket.gethostname(), 10000)
-print('Starting up on {} port {}'.format(*server_address))
-sock.bind(server_address)
-
-# Listen for incoming connections
-sock.listen(1)
-
-while True:
-    # Wait for a connection
-    print('waiting for a connection')
-    connection, client_address = sock.accept()
-    try:
-        print('connection from', client_address)
+import sys
+import time
+
+import numpy as np
+import mentalprotocol as mp
+
+from concurrent.futures import ThreadPoolExecutor
+from mentalfatigue import getpredictor
+
+# |SETTINGS|-------------------------------------------------------------------
+PORT = 10000
+FEATURES = 64           # Features per sample vector
+WORKERS = 4             # Threads running the classifier
+PENDING = 16            # Samples a connection may have waiting for a result
+BATCHWINDOW = 0.002     # Seconds to wait for more samples before predicting
+BATCHSIZE = 64          # Samples that trigger a prediction immediately
+REPORT = 60             # Seconds between batch statistics reports, 0 = off
+CONTEXT = 12            # Seconds filtered before a raw stream block
+LOOKAHEAD = 12          # Seconds filtered after a raw stream block, the reporting delay
+
+# Pre-processing of raw EEG streams when the model bundle does not record it,
+# the eegfeatures defaults; eegfeatures itself (and scipy) is only imported
+# by the first raw stream, so a feature-vector server starts quickly
+STREAM = {'fs': 250,
+          'window': 4,
+          'lowcut': 1,
+          'highcut': 100,
+          'pulsemax': 15,
+          'usemark': False}
+PREPROCESS = ['rejection', 'maxpasses', 'dilate']       # Other bundle params a Stream passes to preprocess
+
+
+ef = None               # eegfeatures once a raw stream needs it
+
+
+def loadfeatures():
+    global ef
+    if ef is None:
+        import eegfeatures
+
+        ef = eegfeatures
+    return ef
+
+
+# -----------------------------------------------------------------------------
+# Stream
+#
+# Description:
+#       Turns the raw samples of one connection into the feature rows that
+# eegfeatures.features gives for the same recording offline. The samples
+# are pre-processed as one continuous signal: every block of one window is
+# filtered together with context seconds before it and lookahead seconds
+# after it, centered on the mean of the samples received so far, and only
+# its kept samples are used. The kept samples are then cut into windows of
+# window * fs samples like the offline recording, so spike rejection never
+# shortens a window; a block that rejects samples completes its window with
+# the next block. A window is therefore reported lookahead seconds late;
+# flush() finishes the last blocks when the client stops sending, and a
+# last window shorter than window * fs is not reported.
+#
+#       The rows match the offline features for recordings without rejected
+# samples and for 'window' rejection. After a spike, the 'iterative' and
+# 'mask' rejections refilter the whole recording offline but only the
+# filtered samples of the block here.
+#
+#       push() and flush() return the blocks to pre-process; clean() runs on
+# the worker pool and may run for several blocks at once, but collect() must
+# be given their results in order.
+#
+# -----------------------------------------------------------------------------
+class Stream:
+    def __init__(self, fs=STREAM['fs'], window=STREAM['window'], context=CONTEXT, lookahead=LOOKAHEAD, usemark=False,
+                 **params):
+        loadfeatures()
+        self.fs = fs
+        self.window = window
+        self.usemark = usemark
+        self.params = params                                            # Other arguments of eegfeatures.preprocess
+        self.step = window * fs
+        # The filter transients do not depend on the window, so the context is
+        # given in seconds; it is rounded up to whole windows so the blocks
+        # keep the window grid of the offline 'window' rejection
+        self.context = -(-int(context * fs) // self.step) * self.step
+        self.lookahead = int(lookahead * fs)
+        self.buffer = np.empty((0, mp.RAW_COLUMNS))
+        self.start = 0                                                  # Stream position of buffer[0]
+        self.done = 0                                                   # Samples handed out in blocks
+        self.sum = np.zeros(mp.RAW_COLUMNS)
+        self.kept = np.empty((len(ef.CHANNELS), 0))
+
+    def push(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        chunk = chunk[~np.isnan(chunk).any(axis=1)]
+        if self.usemark:
+            chunk = chunk[chunk[:, 0] < ef.MARKMAX]
+        self.sum += chunk.sum(axis=0)
+        self.buffer = np.concatenate([self.buffer, chunk])
+        blocks = []
+        while self.start + len(self.buffer) >= self.done + self.step + self.lookahead:
+            blocks.append(self.block(self.done + self.step))
+        return blocks
+
+    def flush(self):
+        blocks = []
+        if self.start + len(self.buffer) > self.done:
+            blocks.append(self.block(self.start + len(self.buffer)))
+        return blocks
+
+    # -------------------------------------------------------------------------
+    # block
+    #
+    # Description:
+    #       This method returns the samples from context seconds before done
+    # up to lookahead seconds after stop, the centering mean and the range
+    # of done..stop in them, and drops the samples no later block needs.
+    #
+    # -------------------------------------------------------------------------
+    def block(self, stop):
+        begin = max(self.done - self.context, 0)
+        end = min(stop + self.lookahead, self.start + len(self.buffer))
+        data = self.buffer[begin - self.start:end - self.start].copy()
+        block = (data, self.sum / (self.start + len(self.buffer)), self.done - begin, stop - begin)
+        self.done = stop
+        drop = max(self.done - self.context, 0) - self.start
+        self.buffer = self.buffer[drop:]
+        self.start += drop
+        return block
+
+    def clean(self, block):
+        data, center, first, last = block
+        eeg, index = ef.preprocess(data, self.fs, window=self.window, center=center, rejectrange=(first, last),
+                                   withindex=True, **self.params)
+        return eeg[:, (index >= first) & (index < last)]
+
+    # -------------------------------------------------------------------------
+    # collect
+    #
+    # Description:
+    #       This method appends the kept samples of the next block and returns
+    # the feature rows (windows x 64) of the windows they complete.
+    #
+    # -------------------------------------------------------------------------
+    def collect(self, eeg):
+        self.kept = np.concatenate([self.kept, eeg], axis=1)
+        count = self.kept.shape[1] // self.step
+        windows = self.kept[:, :count * self.step].reshape(len(ef.CHANNELS), count, self.step).transpose(1, 0, 2)
+        self.kept = self.kept[:, count * self.step:]
+        if not count:
+            return np.empty((0, len(ef.FEATURENAMES)))
+        return ef.extractfeatures(ef.periodogram(windows, self.fs), self.window)
+
+
+# -----------------------------------------------------------------------------
+# Batcher
+#
+# Description:
+#       Collects the samples completed by all connections over a short window
+# and classifies them with one call on the stacked matrix, so the kernel
+# evaluation against the support vectors is shared by the whole batch. A
+# window of 0 with a size of 1 predicts every sample on its own.
+#
+# -----------------------------------------------------------------------------
+class Batcher:
+    def __init__(self, predictor, pool, workers=WORKERS, window=BATCHWINDOW, size=BATCHSIZE):
+        self.predictor = predictor
+        self.pool = pool
+        self.window = window
+        self.size = size
+        self.slots = asyncio.Semaphore(workers)
+        self.samples = []
+        self.futures = []
+        self.started = []
+        self.timer = None
+        self.tasks = set()                                              # Running batches, kept until done
+
+        # Statistics
+        self.sizes = collections.Counter()
+        self.vectors = 0
+        self.waited = 0.0
 
-        # Receive the data in small chunks and retransmit it
+    # -------------------------------------------------------------------------
+    # submit
+    #
+    # Description:
+    #       This method queues one sample and returns a future for its class.
+    #
+    # -------------------------------------------------------------------------
+    def submit(self, sample):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            sample = self.predictor.align(sample)
+        except ValueError as err:
+            future.set_exception(err)
+            return future
+        expected = self.predictor.mean.shape[0]
+        if sample.shape != (expected,):
+            future.set_exception(ValueError('expected {} features, got {}'.format(expected, sample.size)))
+            return future
+
+        self.samples.append(sample)
+        self.futures.append(future)
+        self.started.append(time.monotonic())
+        if len(self.samples) >= self.size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return future
+
+    # -------------------------------------------------------------------------
+    # flush
+    #
+    # Description:
+    #       This method hands the queued samples to the worker pool.
+    #
+    # -------------------------------------------------------------------------
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.samples:
+            return
+        batch = (np.vstack(self.samples), self.futures, self.started)
+        self.samples, self.futures, self.started = [], [], []
+        self.sizes[batch[0].shape[0]] += 1
+        task = asyncio.ensure_future(self.run(*batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # -------------------------------------------------------------------------
+    # run
+    #
+    # Description:
+    #       This method classifies one batch and resolves its futures. A
+    # failure is logged and set on every future still waiting, so no
+    # connection waits forever for its result.
+    #
+    # -------------------------------------------------------------------------
+    async def run(self, x, futures, started):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.slots:
+                try:
+                    predict = await loop.run_in_executor(self.pool, self.predictor.predict_batch, x)
+                except Exception as err:
+                    print('batch of {} failed: {}'.format(len(futures), err))
+                    predict = [err] * len(futures)
+            if len(predict) != len(futures):
+                raise ValueError('{} results for {} samples'.format(len(predict), len(futures)))
+            done = time.monotonic()
+            for future, result, start in zip(futures, predict, started):
+                self.vectors += 1
+                self.waited += done - start
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as err:
+            print('batch of {} failed: {}'.format(len(futures), err))
+            for future in futures:
+                if not future.done():
+                    future.set_exception(err)
+
+    # -------------------------------------------------------------------------
+    # stats
+    #
+    # Description:
+    #       This method summarizes the batch sizes achieved so far.
+    #
+    # -------------------------------------------------------------------------
+    def stats(self):
+        batches = sum(self.sizes.values())
+        return {'batches': batches,
+                'vectors': self.vectors,
+                'mean size': self.vectors / batches if batches else 0.0,
+                'max size': max(self.sizes) if self.sizes else 0,
+                'mean latency ms': 1000 * self.waited / self.vectors if self.vectors else 0.0,
+                'sizes': dict(sorted(self.sizes.items()))}
+
+
+# -----------------------------------------------------------------------------
+# MentalServer
+#
+# Description:
+#       Serves many headset connections at once. Each connection assembles
+# its own feature vectors, and the vectors are classified on a shared,
+# preloaded model in a bounded thread pool so that the event loop keeps
+# reading sockets while the classifier runs. Samples that complete at about
+# the same time are micro-batched into one prediction.
+#
+# -----------------------------------------------------------------------------
+class MentalServer:
+    def __init__(self, host, port=PORT, workers=WORKERS, window=BATCHWINDOW, size=BATCHSIZE, stream=None):
+        self.address = (host, port)
+        self.predictor = getpredictor()
+        self.stream = dict(STREAM, **(stream or self.trained()))
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.batcher = None
+        self.reporter = None
+        self.workers = workers
+        self.window = window
+        self.size = size
+
+    # -------------------------------------------------------------------------
+    # trained
+    #
+    # Description:
+    #       This method returns the pre-processing parameters the model was
+    # trained with, as far as the raw streams use them: the STREAM settings
+    # and the PREPROCESS spike rejection arguments.
+    #
+    # -------------------------------------------------------------------------
+    def trained(self):
+        params = self.predictor.params or {}
+        return {name: value for name, value in params.items() if name in STREAM or name in PREPROCESS}
+
+    # -------------------------------------------------------------------------
+    # predict
+    #
+    # Description:
+    #       This method queues one sample on the shared batcher.
+    #
+    # -------------------------------------------------------------------------
+    async def predict(self, sample):
+        return await self.batcher.submit(sample)
+
+    # -------------------------------------------------------------------------
+    # classify
+    #
+    # Description:
+    #       This method pre-processes one block of a raw stream on the worker
+    # pool and classifies the windows it completes. The blocks of a stream
+    # are pre-processed in parallel, but collected in order: each one waits
+    # for the block before it. Returns the labels, one per window.
+    #
+    # -------------------------------------------------------------------------
+    async def classify(self, stream, block, previous=None):
+        loop = asyncio.get_running_loop()
+        eeg = await loop.run_in_executor(self.pool, stream.clean, block)
+        if previous is not None:
+            await asyncio.wait([previous])
+        feats = stream.collect(eeg)
+        index = [ef.FEATURENAMES.index(name) for name in self.predictor.features]
+        return list(await asyncio.gather(*[self.predict(row[index]) for row in feats]))
+
+    async def report(self):
         while True:
-            i = 0
-            sample = []
-            while i != 63:
-                data = connection.recv(32)
-                if data:
-                    # connection.sendall(data)
-
-                    pkg = data.decode('utf-8').split()
-                    [i, feat] = int(pkg[0]), float(pkg[1])
-                    sample.append(feat)
-            connection.sendall(assess(sample).encode('utf-8'))
-
-
-    finally:
-        # Clean up the connection
-        print("Closing current connection")
-        connection.close()
\ No newline at end of file
+            await asyncio.sleep(REPORT)
+            try:
+                print('batch statistics:', self.batcher.stats())
+                if ef is not None:
+                    print('filter designs:', ef.filterstats())
+            except Exception as err:
+                print('report failed:', err)
+
+    # -------------------------------------------------------------------------
+    # respond
+    #
+    # Description:
+    #       This method sends the results back to the client in the order the
+    # samples were received. Binary clients receive framed results.
+    #
+    # -------------------------------------------------------------------------
+    async def respond(self, writer, pending, binary):
+        while True:
+            result = await pending.get()
+            if result is None:
+                break
+            try:
+                labels = await result
+                for label in labels if isinstance(labels, list) else [labels]:
+                    label = str(label).encode('utf-8')
+                    writer.write(mp.packframe(mp.RESULT, label) if binary else label)
+            except Exception as err:
+                print('prediction failed:', err)
+                if binary:
+                    writer.write(mp.packframe(mp.ERROR, str(err).encode('utf-8')))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    # -------------------------------------------------------------------------
+    # readtext
+    #
+    # Description:
+    #       This method reads the feature lines from a text client. A line
+    # holds the feature index and value separated by a tab. Once the last
+    # feature arrives, the sample is handed to the worker pool.
+    #
+    # -------------------------------------------------------------------------
+    async def readtext(self, reader, pending, prefix):
+        sample = []
+        data = prefix + await reader.readline()
+        while data:
+            pkg = data.decode('utf-8').split()
+            if len(pkg) == 2:
+                [i, feat] = int(pkg[0]), float(pkg[1])
+                sample.append(feat)
+                if i == FEATURES - 1:
+                    await pending.put(asyncio.ensure_future(self.predict(sample)))
+                    sample = []
+            data = await reader.readline()
+
+    # -------------------------------------------------------------------------
+    # readframes
+    #
+    # Description:
+    #       This method reads length-prefixed frames from a binary client.
+    # Every feature frame holds one whole sample; a payload that is not a
+    # whole number of floats is answered with an error frame. Raw frames hold
+    # any number of raw samples and a result is sent each time a window of
+    # kept samples fills (see Stream); the last windows are sent when the
+    # client stops sending.
+    #
+    # -------------------------------------------------------------------------
+    async def readframes(self, reader, pending):
+        stream = None
+        previous = None
+        while True:
+            try:
+                kind, payload = await mp.readframe(reader)
+            except asyncio.IncompleteReadError:
+                break
+            if kind == mp.FEATURES:
+                try:
+                    sample = mp.unpackfeatures(payload)
+                except ValueError as err:
+                    # The framing is intact, so only this sample gets an error
+                    failed = asyncio.get_running_loop().create_future()
+                    failed.set_exception(err)
+                    await pending.put(failed)
+                    continue
+                await pending.put(asyncio.ensure_future(self.predict(sample)))
+            elif kind == mp.RAW:
+                if stream is None:
+                    stream = Stream(**self.stream)
+                for block in stream.push(mp.unpackraw(payload)):
+                    previous = asyncio.ensure_future(self.classify(stream, block, previous))
+                    await pending.put(previous)
+            else:
+                raise ValueError('unexpected frame kind {}'.format(kind))
+        if stream is not None:
+            for block in stream.flush():
+                previous = asyncio.ensure_future(self.classify(stream, block, previous))
+                await pending.put(previous)
+
+    # -------------------------------------------------------------------------
+    # handle
+    #
+    # Description:
+    #       This method serves one client. A client that opens with the
+    # protocol greeting speaks binary frames; anything else is treated as the
+    # original text protocol.
+    #
+    # -------------------------------------------------------------------------
+    async def handle(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        print('connection from', client_address)
+        pending = asyncio.Queue(PENDING)
+        responder = None
+        try:
+            prefix = await reader.read(1)
+            binary = prefix == mp.MAGIC[:1]
+            if binary:
+                hello = prefix + await reader.readexactly(len(mp.MAGIC))
+                if hello[:len(mp.MAGIC)] != mp.MAGIC or hello[-1] > mp.VERSION:
+                    raise ValueError('unsupported greeting {!r}'.format(hello))
+                writer.write(mp.greeting())
+            responder = asyncio.create_task(self.respond(writer, pending, binary))
+            if binary:
+                await self.readframes(reader, pending)
+            elif prefix:
+                await self.readtext(reader, pending, prefix)
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as err:
+            print('connection error from', client_address, err)
+        finally:
+            # Clean up the connection
+            if responder is not None:
+                await pending.put(None)
+                await responder
+            print("Closing connection from", client_address)
+            writer.close()
+
+    async def serve(self):
+        self.batcher = Batcher(self.predictor, self.pool, self.workers, self.window, self.size)
+        server = await asyncio.start_server(self.handle, *self.address)
+        print('Starting up on {} port {}'.format(*self.address))
+        if REPORT:
+            self.reporter = asyncio.create_task(self.report())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.reporter is not None:
+                self.reporter.cancel()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(MentalServer(socket.gethostname()).serve())
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
@@ -0,0 +1,163 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scipy import fftpack, signal
+
+import eegfeatures as ef
+
+
+# -----------------------------------------------------------------------------
+# original
+#
+# Description:
+#       The loop based EegGui.preprocess and EegGui.extractfeatures the
+# vectorised pipeline replaced, kept as the reference of the features. The
+# spikes are rejected without a pass limit.
+#
+# -----------------------------------------------------------------------------
+def original(data, window=ef.WINDOW, pulsemax=ef.PULSEMAX, lowcut=ef.LOWCUT, highcut=ef.HIGHCUT, fs=ef.FS):
+    eegdf = pd.DataFrame(data, columns=ef.COLUMNS)
+    fftdf = pd.DataFrame(columns=['Freq', 'EEG1fft', 'EEG2fft', 'EEG3fft', 'EEG4fft'])
+    datalist = []
+
+    [b, a] = signal.butter(4, [lowcut / fs, highcut / fs], btype='bandpass')
+    eegdf['Total'] = 0
+    eegdf = (eegdf - eegdf.mean()) * 1.64498
+    for col in ef.CHANNELS:
+        eegdf[col] = signal.filtfilt(b, a, eegdf[col])
+    eegdf['Total'] = eegdf.abs().mean(axis=1)
+    while (eegdf['Total'] > pulsemax).sum():
+        eegdf = eegdf[eegdf['Total'] < pulsemax].copy()
+        for col in ef.CHANNELS:
+            eegdf[col] = signal.filtfilt(b, a, eegdf[col])
+        eegdf['Total'] = eegdf.abs().mean(axis=1)
+    eegdf.reset_index(inplace=True)
+    size = eegdf.shape[0]
+
+    fftdf['Freq'] = np.linspace(0.0, fs / 2, fs * window // 2 + 1)
+    for i in range(0, size, window * fs):
+        df = eegdf.iloc[i:i + window * fs]
+        N = df.shape[0]
+        for col in ef.CHANNELS:
+            fft = fftpack.fft(df[col].to_numpy())[0:N // 2 + 1]
+            fft = 1 / (fs * N) * np.abs(fft) ** 2
+            fft[2:-2] = [2 * x for x in fft[2:-2]]
+            fftdf[col + 'fft'] = pd.Series(fft)
+        if N:
+            datalist.append(extractfeatures(fftdf, window))
+    return np.array(datalist, dtype=np.float64)
+
+
+def extractfeatures(freqdf, window):
+    feat = []
+    deltamean = freqdf.iloc[:4 * window].mean()
+    thetamean = freqdf.iloc[4 * window + 1:8 * window].mean()
+    alphamean = freqdf.iloc[8 * window + 1:15 * window].mean()
+    betamean = freqdf.iloc[15 * window + 1:32 * window].mean()
+    gammamean = freqdf.iloc[32 * window + 1:].mean()
+    freqmean = freqdf.mean()
+    for sensor in ['EEG1fft', 'EEG2fft', 'EEG3fft', 'EEG4fft']:
+        delta = deltamean[sensor]
+        theta = thetamean[sensor]
+        alpha = alphamean[sensor]
+        beta = betamean[sensor]
+        gamma = gammamean[sensor]
+        phi = freqmean[sensor]
+        feat.extend([delta, theta, alpha, beta, gamma, phi, theta / beta, theta / alpha, theta / phi,
+                     theta / (beta + alpha + gamma), delta / (beta + alpha + gamma), delta / alpha, delta / phi,
+                     delta / beta, delta / theta, (theta + alpha) / beta])
+    return feat
+
+
+@pytest.mark.filterwarnings('ignore:.*NaN features:RuntimeWarning')
+@pytest.mark.parametrize('seconds, spikes', [(120, 0), (181, 0), (180, 10)])
+def test_features_match_original(recording, seconds, spikes):
+    data = recording(seconds, seed=3, spikes=spikes)
+    expected = original(data)
+    assert expected.shape[0] > 0
+    np.testing.assert_allclose(ef.features(data), expected, rtol=1e-6)
+
+
+def test_features_match_original_float32(recording):
+    data = recording(120, seed=4, spikes=5).astype(np.float32)
+    np.testing.assert_allclose(ef.features(data), original(data), rtol=1e-6)
+
+
+def test_window_matrices_match_loops():
+    rng = np.random.default_rng(5)
+    psd = rng.random((3, len(ef.CHANNELS), ef.WINDOW * ef.FS // 2 + 1))
+    for w, rows in enumerate(psd):
+        freqdf = pd.DataFrame(rows.T, columns=['EEG1fft', 'EEG2fft', 'EEG3fft', 'EEG4fft'])
+        np.testing.assert_allclose(ef.extractfeatures(psd)[w], extractfeatures(freqdf, ef.WINDOW), rtol=1e-12)
+
+
+@pytest.mark.parametrize('rejection', ['iterative', 'mask', 'window'])
+def test_rejection_clean(recording, rejection):
+    data = recording(120)
+    report = {}
+    feat = ef.features(data, rejection=rejection, report=report)
+    assert feat.shape == (30, len(ef.FEATURENAMES))
+    assert report['dropped samples'] == 0 and report['passes'] == 0
+    assert report['rows'] == 30 and report['nan rows'] == 0
+
+
+def test_rejection_iterative(recording):
+    data = recording(120, seed=1, spikes=20)
+    report = {}
+    feat = ef.features(data, rejection='iterative', report=report)
+    assert 0 < report['dropped samples'] < report['samples']
+    assert 0 < report['passes'] <= ef.MAXPASSES
+    assert feat.shape[0] == -(-(report['samples'] - report['dropped samples']) // (ef.WINDOW * ef.FS))
+    eeg = ef.preprocess(data, rejection='iterative')
+    assert eeg.shape[1] == report['samples'] - report['dropped samples']
+
+
+def test_rejection_mask(recording):
+    data = recording(120, seed=1, spikes=20)
+    report, dilated = {}, {}
+    ef.features(data, rejection='mask', report=report)
+    ef.features(data, rejection='mask', dilate=25, report=dilated)
+    assert report['passes'] == 1
+    assert 0 < report['dropped samples'] < dilated['dropped samples']
+
+
+def test_rejection_window(recording):
+    data = recording(120, seed=1, spikes=5)
+    report = {}
+    feat = ef.features(data, rejection='window', report=report)
+    step = ef.WINDOW * ef.FS
+    assert report['passes'] == 0 and report['dropped windows'] > 0
+    assert report['dropped samples'] == report['dropped windows'] * step
+    assert feat.shape[0] == report['windows'] - report['dropped windows']
+
+
+def test_rejection_unknown(recording):
+    with pytest.raises(ValueError, match='rejection'):
+        ef.features(recording(20), rejection='median')
+
+
+def test_every_window_rejected_warns(recording):
+    data = recording(120, seed=2, spikes=200)
+    report = {}
+    with pytest.warns(RuntimeWarning, match='every window was rejected'):
+        feat = ef.features(data, rejection='window', report=report)
+    assert feat.shape == (0, len(ef.FEATURENAMES))
+    assert report['rows'] == 0 and report['dropped windows'] == report['windows']
+
+
+def test_nan_features_warn(recording):
+    # The samples left by the rejection end in a window too short for the bands
+    data = recording(120, seed=2, spikes=50)
+    report = {}
+    with pytest.warns(RuntimeWarning, match='NaN features'):
+        feat = ef.features(data, rejection='iterative', report=report)
+    assert report['nan rows'] == np.isnan(feat).any(axis=1).sum() == 1
+
+
+def test_clean_recording_does_not_warn(recording):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        ef.features(recording(60, seed=2, spikes=5))
@@ -0,0 +1,145 @@
+import os
+import pickle as pk
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.svm import SVC
+
+import eegfeatures as ef
+import eegmodel as em
+import mentalfatigue as mf
+
+CLASSES = np.array(['Fatigued', 'Not Fatigued'])
+
+
+def trained(features, gamma=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((120, len(features)))
+    y = CLASSES[(x[:, 0] + 0.5 * rng.standard_normal(120) > 0).astype(int)]
+    return SVC(kernel='rbf', gamma=gamma).fit(x, y), x
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    features = ef.FEATURENAMES[:8]
+    model, x = trained(features)
+    mean = pd.Series(np.linspace(1, 2, len(features)), index=features)
+    std = pd.Series(np.linspace(2, 3, len(features)), index=features)
+    filename = str(tmp_path / em.MODELFILE)
+    em.save(filename, model, mean, std, params={'window': 4})
+    return filename, model, x, mean, std
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+@pytest.mark.parametrize('native', [True, False])
+def test_save_load_round_trip(bundle, mmap, native):
+    filename, model, x, mean, std = bundle
+    loaded = em.load(filename, mmap=mmap, native=native)
+    assert loaded.features == list(mean.index)
+    assert loaded.params == {'window': 4}
+    np.testing.assert_array_equal(loaded.mean, mean.to_numpy())
+    np.testing.assert_array_equal(loaded.std, std.to_numpy())
+    assert isinstance(loaded.model, em.RbfSVC if native else SVC)
+    np.testing.assert_array_equal(loaded.model.predict(x), model.predict(x))
+    np.testing.assert_allclose(loaded.model.decision_function(x), model.decision_function(x), rtol=1e-9)
+
+
+def test_load_maps_the_file(bundle):
+    loaded = em.load(bundle[0], native=True)
+    assert not loaded.mean.flags.writeable
+    assert isinstance(loaded.model.support_vectors_.base, np.memmap)
+
+
+def test_native_arrays_stored_once(bundle):
+    header = em.load(bundle[0]).header
+    offsets = {spec['offset'] for spec in header['buffers']}
+    assert header['arrays']['support_vectors']['offset'] in offsets
+    assert header['arrays']['dual_coef']['offset'] in offsets
+
+
+def test_load_rejects_other_files(tmp_path):
+    filename = str(tmp_path / 'model.sav')
+    pk.dump({'model': None}, open(filename, 'wb'))
+    with pytest.raises(ValueError, match='not a model bundle'):
+        em.load(filename)
+
+
+def test_save_needs_feature_names(tmp_path):
+    model, x = trained(ef.FEATURENAMES[:4])
+    with pytest.raises(ValueError, match='feature names'):
+        em.save(str(tmp_path / em.MODELFILE), model, [0.0] * 4, [1.0] * 4)
+
+
+def legacy(folder, series):
+    model, x = trained(ef.FEATURENAMES)
+    mean = pd.Series(np.zeros(len(ef.FEATURENAMES)), index=ef.FEATURENAMES)
+    std = pd.Series(np.ones(len(ef.FEATURENAMES)), index=ef.FEATURENAMES)
+    for name, value in zip(mf.LEGACY, [model, mean, std]):
+        if not series and name != mf.LEGACY[0]:
+            value = value.to_list()
+        pk.dump(value, open(os.path.join(folder, name), 'wb'))
+    return model, x
+
+
+@pytest.mark.parametrize('series', [True, False])
+def test_convert_legacy(tmp_path, series):
+    model, x = legacy(str(tmp_path), series)
+    script = os.path.join(os.path.dirname(os.path.abspath(em.__file__)), 'eegmodel.py')
+    subprocess.run([sys.executable, script, 'convert'] + mf.LEGACY + ['--out', em.MODELFILE],
+                   cwd=str(tmp_path), check=True, capture_output=True)
+    loaded = em.load(str(tmp_path / em.MODELFILE))
+    assert loaded.features == ef.FEATURENAMES
+    np.testing.assert_array_equal(loaded.model.predict(x), model.predict(x))
+
+
+@pytest.mark.parametrize('series', [True, False])
+def test_predictor_legacy_fallback(tmp_path, series):
+    model, x = legacy(str(tmp_path), series)
+    with pytest.warns(FutureWarning, match='eegmodel.py convert'):
+        predictor = mf.Predictor(str(tmp_path))
+    assert predictor.features == ef.FEATURENAMES
+    np.testing.assert_array_equal(predictor.predict_batch(x), model.predict(x))
+
+
+def test_predictor_needs_a_model(tmp_path):
+    with pytest.raises(FileNotFoundError, match='eegmodel.py convert'):
+        mf.Predictor(str(tmp_path))
+
+
+def test_predictor_aligns_subsets(bundle):
+    filename, model, x, mean, std = bundle
+    predictor = mf.Predictor(os.path.dirname(filename))
+    expected = model.predict((x - mean.to_numpy()) / std.to_numpy())
+
+    full = np.zeros((x.shape[0], len(ef.FEATURENAMES)))
+    full[:, :x.shape[1]] = x
+    np.testing.assert_array_equal(predictor.predict_batch(x), expected)
+    np.testing.assert_array_equal(predictor.predict_batch(full), expected)
+    frame = pd.DataFrame(full, columns=ef.FEATURENAMES).iloc[:, ::-1]
+    np.testing.assert_array_equal(predictor.predict_batch(frame), expected)
+    with pytest.raises(ValueError, match='expected 8 features'):
+        predictor.predict_batch(x[:, :5])
+
+
+@pytest.mark.parametrize('gamma', [0.05, 'auto'])
+def test_rbfsvc_matches_decision_function(gamma):
+    model, x = trained(ef.FEATURENAMES, gamma=gamma)
+    arrays, spec = em.export(model)
+    native = em.RbfSVC(arrays['support_vectors'], arrays['dual_coef'], arrays['intercept'], spec['gamma'],
+                       spec['classes'])
+    rows = np.random.default_rng(1).standard_normal((em.BLOCK + 7, x.shape[1]))
+    expected = model.decision_function(rows)
+    assert np.max(np.abs(native.decision_function(rows) - expected)) <= 1e-9 * np.max(np.abs(expected))
+    np.testing.assert_array_equal(native.predict(rows), model.predict(rows))
+    np.testing.assert_allclose(native.decision_function(rows[:3]), native.decision_function(rows)[:3], rtol=1e-12)
+
+
+def test_export_needs_a_resolved_gamma():
+    model, x = trained(ef.FEATURENAMES[:4], gamma='scale')
+    assert em.export(model) is None
+    model.set_params(gamma=1.0 / (x.shape[1] * x.var()))
+    assert em.export(model) is not None
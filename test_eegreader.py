@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import eegfeatures as ef
+import eegreader as er
+
+
+@pytest.fixture
+def csvfile(tmp_path, recording):
+    df = pd.DataFrame(recording(60), columns=ef.COLUMNS)
+    df.insert(0, 'TimeStamp', np.arange(len(df)))
+    df.loc[[5, 700, 9000], 'EEG2'] = np.nan
+    filename = str(tmp_path / 'rec_pre_1.csv')
+    df[['TimeStamp', 'EEG4', 'Marker', 'EEG1', 'EEG2', 'EEG3']].to_csv(filename, index=False)
+    return filename
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_convert_in_chunks(csvfile, tmp_path, engine):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    npyfile = str(tmp_path / 'rec.npy')
+    rows = er.convert(csvfile, npyfile, chunksize=1000, engine=engine)
+    data = np.load(npyfile, mmap_mode='r')
+    expected = er.readcsv(csvfile, engine='c')
+    assert rows == data.shape[0] == 60 * ef.FS - 3
+    assert data.dtype == er.DTYPE
+    np.testing.assert_array_equal(data, expected)
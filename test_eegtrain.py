@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import eegfeatures as ef
+import eegtrain as et
+
+
+@pytest.fixture
+def folder(tmp_path, recording):
+    for i, name in enumerate(['rec_pre_1.csv', 'rec_post_2.csv']):
+        pd.DataFrame(recording(40, seed=i), columns=ef.COLUMNS).to_csv(tmp_path / name, index=False)
+    (tmp_path / 'rec_pre_3.csv').write_text('Marker,EEG1\nnot,a recording\n')
+    return str(tmp_path)
+
+
+def test_ingest_stops_on_failed_recordings(folder):
+    with pytest.raises(RuntimeError, match='rec_pre_3.csv'):
+        et.ingest(folder, et.PARAMS, workers=1, cache=None)
+
+
+def test_ingest_reports_failed_recordings(folder):
+    failed = {}
+    df = et.ingest(folder, et.PARAMS, workers=1, cache=None, failed=failed)
+    assert list(failed) == ['rec_pre_3.csv']
+    assert len(df) == 20
+    assert sorted(np.unique(df['Class'])) == ['Fatigued', 'Not Fatigued']
+
+
+@pytest.mark.parametrize('count, factor, rungs', [(1, 3, 0), (3, 3, 0), (4, 3, 1), (27, 3, 2), (28, 3, 3),
+                                                  (125, 5, 2), (243, 3, 4), (1000, 10, 2), (50, 1, 0)])
+def test_halvings(count, factor, rungs):
+    assert et.halvings(count, factor) == rungs
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+import eegfeatures as ef
+import eegview as ev
+
+
+@pytest.mark.parametrize('mode', ev.BANDMODES)
+def test_bands_follow_mode(recording, mode):
+    view = ev.StageView(recording(20), dtype=np.float64, mode=mode)
+    expected = ef.getbands(view.stage(ev.STAGES.index('')), mode=mode)
+    for band, name in enumerate(ef.BANDS):
+        np.testing.assert_allclose(view.stage(ev.STAGES.index(name)), expected[band], rtol=1e-7, atol=1e-9)
+
+
+def test_band_modes_differ(recording):
+    data = recording(20)
+    bank, subtractive = [ev.StageView(data, mode=mode).stage(ev.STAGES.index('Alpha')) for mode in ev.BANDMODES]
+    assert not np.allclose(bank, subtractive)
+
+
+def test_unknown_band_mode(recording):
+    with pytest.raises(ValueError, match='mode'):
+        ev.StageView(recording(5), mode='wavelet')
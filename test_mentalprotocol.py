@@ -0,0 +1,175 @@
+import asyncio
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import mentalprotocol as mp
+import mentalserver as ms
+
+FEATURES = 4
+
+
+class Predictor:
+    mean = np.zeros(FEATURES)
+    features = ['f{}'.format(i) for i in range(FEATURES)]
+    params = None
+
+    def align(self, x):
+        return np.asarray(x, dtype=np.float64)
+
+    def predict_batch(self, x):
+        return np.where(x[:, 0] > 0, 'Fatigued', 'Not Fatigued')
+
+
+# -----------------------------------------------------------------------------
+# serving
+#
+# Description:
+#       Runs test(host, port) against a MentalServer on a free local port,
+# with the Predictor above, inside one event loop.
+#
+# -----------------------------------------------------------------------------
+def serving(monkeypatch, test):
+    monkeypatch.setattr(ms, 'getpredictor', Predictor)
+
+    async def main():
+        server = ms.MentalServer('127.0.0.1', 0, workers=2, window=0.001, size=8)
+        server.batcher = ms.Batcher(server.predictor, server.pool, 2, server.window, server.size)
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        try:
+            async with listener:
+                return await test(*listener.sockets[0].getsockname()[:2])
+        finally:
+            server.pool.shutdown()
+    return asyncio.run(main())
+
+
+async def connect(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(mp.greeting())
+    assert await reader.readexactly(len(mp.greeting())) == mp.greeting()
+    return reader, writer
+
+
+async def results(reader):
+    frames = []
+    while True:
+        try:
+            kind, payload = await mp.readframe(reader)
+        except asyncio.IncompleteReadError:
+            return frames
+        frames.append((kind, bytes(payload).decode('utf-8')))
+
+
+def samples(count):
+    return np.array([[1.0 if i % 2 else -1.0] + [0.0] * (FEATURES - 1) for i in range(count)])
+
+
+def classes(count):
+    return ['Fatigued' if i % 2 else 'Not Fatigued' for i in range(count)]
+
+
+def labels(count):
+    return [(mp.RESULT, label) for label in classes(count)]
+
+
+def test_split_frames(monkeypatch):
+    async def test(host, port):
+        reader, writer = await connect(host, port)
+        data = b''.join(mp.packfeatures(x) for x in samples(3))
+        for i in range(len(data)):
+            writer.write(data[i:i + 1])                                 # One byte per segment
+            await writer.drain()
+            await asyncio.sleep(0)
+        writer.write_eof()
+        return await results(reader)
+    assert serving(monkeypatch, test) == labels(3)
+
+
+def test_coalesced_frames(monkeypatch):
+    async def test(host, port):
+        reader, writer = await connect(host, port)
+        writer.write(b''.join(mp.packfeatures(x) for x in samples(20)))  # All frames in one segment
+        writer.write_eof()
+        return await results(reader)
+    assert serving(monkeypatch, test) == labels(20)
+
+
+def test_partial_float_payload(monkeypatch):
+    async def test(host, port):
+        reader, writer = await connect(host, port)
+        x = samples(2)
+        writer.write(mp.packfeatures(x[0]) + mp.packframe(mp.FEATURES, b'\0' * 12) + mp.packfeatures(x[1]))
+        writer.write_eof()
+        return await results(reader)
+    first, error, last = serving(monkeypatch, test)
+    assert [first, last] == labels(2)
+    assert error[0] == mp.ERROR and 'whole number' in error[1]
+
+
+def test_wrong_feature_count(monkeypatch):
+    async def test(host, port):
+        reader, writer = await connect(host, port)
+        writer.write(mp.packfeatures(np.zeros(FEATURES + 1)))
+        writer.write_eof()
+        return await results(reader)
+    [(kind, message)] = serving(monkeypatch, test)
+    assert kind == mp.ERROR and 'expected {} features'.format(FEATURES) in message
+
+
+def test_maxframe(monkeypatch):
+    async def test(host, port):
+        reader, writer = await connect(host, port)
+        writer.write(mp.HEADER.pack(mp.FEATURES, mp.MAXFRAME + 1))
+        await writer.drain()
+        return await asyncio.wait_for(reader.read(), 5)
+    assert serving(monkeypatch, test) == b''                            # Closed without reading the payload
+
+
+def test_readframe_limits():
+    async def test():
+        reader = asyncio.StreamReader()
+        reader.feed_data(mp.HEADER.pack(mp.RAW, mp.MAXFRAME) + b'\0' * mp.MAXFRAME)
+        reader.feed_data(mp.HEADER.pack(mp.RAW, mp.MAXFRAME + 1))
+        kind, payload = await mp.readframe(reader)
+        assert (kind, len(payload)) == (mp.RAW, mp.MAXFRAME)
+        with pytest.raises(ValueError, match='limit'):
+            await mp.readframe(reader)
+    asyncio.run(test())
+
+
+def test_unpack():
+    x = np.arange(10, dtype=np.float32).reshape(2, 5)
+    np.testing.assert_array_equal(mp.unpackraw(mp.packraw(x)[mp.HEADER.size:]), x)
+    with pytest.raises(ValueError, match='whole number of samples'):
+        mp.unpackraw(mp.packraw(x)[mp.HEADER.size:-4])
+    with pytest.raises(ValueError, match='whole number of values'):
+        mp.unpackraw(b'\0' * 6)
+    with pytest.raises(ValueError, match='whole number of values'):
+        mp.unpackfeatures(b'\0' * 9)
+
+
+def test_recvframe_split():
+    left, right = socket.socketpair()
+    data = mp.packfeatures(np.arange(3.0)) + mp.packframe(mp.RESULT, b'Fatigued')
+
+    def send():
+        for i in range(0, len(data), 3):
+            left.sendall(data[i:i + 3])
+            time.sleep(0.001)
+        left.close()
+    sender = threading.Thread(target=send)
+    sender.start()
+    try:
+        kind, payload = mp.recvframe(right)
+        assert kind == mp.FEATURES
+        np.testing.assert_array_equal(mp.unpackfeatures(payload), np.arange(3.0))
+        assert mp.recvframe(right)[1].tobytes() == b'Fatigued'
+        with pytest.raises(ConnectionError):
+            mp.recvframe(right)
+    finally:
+        sender.join()
+        right.close()
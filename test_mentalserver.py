@@ -0,0 +1,135 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import types
+
+import numpy as np
+import pytest
+
+import eegfeatures as ef
+import mentalserver as ms
+
+from concurrent.futures import ThreadPoolExecutor
+from test_mentalprotocol import FEATURES, Predictor, classes, samples
+
+
+def streamed(data, chunk, **params):
+    stream = ms.Stream(**params)
+    blocks = []
+    for i in range(0, data.shape[0], chunk):
+        blocks += stream.push(data[i:i + chunk])
+    blocks += stream.flush()
+    return np.vstack([stream.collect(stream.clean(block)) for block in blocks])
+
+
+@pytest.mark.parametrize('rejection', ['iterative', 'mask', 'window'])
+@pytest.mark.parametrize('chunk', [25, 37, 1000])
+def test_stream_matches_features(recording, rejection, chunk):
+    data = recording(120)
+    report = {}
+    offline = ef.features(data, rejection=rejection, report=report)
+    assert report['dropped samples'] == 0
+    online = streamed(data, chunk, rejection=rejection)
+    assert online.shape == offline.shape
+    np.testing.assert_allclose(online, offline, rtol=1e-5)
+
+
+def test_stream_matches_window_rejection(recording):
+    data = recording(180, seed=1, spikes=20)
+    report = {}
+    offline = ef.features(data, rejection='window', report=report)
+    assert report['dropped windows'] > 0
+    online = streamed(data, 25, rejection='window')
+    assert online.shape == offline.shape
+    np.testing.assert_allclose(online, offline, rtol=1e-5)
+
+
+def test_stream_keeps_full_windows(recording):
+    # Rejected samples are made up by the next block, every window is whole
+    data = recording(120, seed=2, spikes=10)
+    stream = ms.Stream()
+    eeg = []
+    for block in stream.push(data) + stream.flush():
+        eeg.append(stream.clean(block))
+        stream.collect(eeg[-1])
+    kept = sum(part.shape[1] for part in eeg)
+    assert kept < data.shape[0]
+    assert stream.kept.shape[1] == kept % stream.step
+
+
+def test_stream_uses_trained_params(recording, monkeypatch):
+    params = {'fs': ef.FS, 'window': 2, 'lowcut': 1, 'highcut': 100, 'pulsemax': 15, 'usemark': True,
+              'rejection': 'window', 'cache': 'ignored'}
+    monkeypatch.setattr(ms, 'getpredictor', lambda: types.SimpleNamespace(params=params))
+    server = ms.MentalServer('localhost', 0)
+    server.pool.shutdown()
+    assert server.stream == {name: value for name, value in params.items() if name != 'cache'}
+
+    data = recording(120, seed=1, spikes=5)
+    data[10000:12000, 0] = ef.MARKMAX                                   # Unmarked samples
+    online = streamed(data, 37, **server.stream)
+    offline = ef.features(data, **{name: value for name, value in server.stream.items() if name != 'fs'})
+    assert online.shape == offline.shape
+    assert offline.shape[0] < ef.features(data, window=2, rejection='window').shape[0]
+    np.testing.assert_allclose(online, offline, rtol=1e-5)
+
+
+def test_stream_defaults_follow_eegfeatures():
+    assert ms.STREAM == {'fs': ef.FS, 'window': ef.WINDOW, 'lowcut': ef.LOWCUT, 'highcut': ef.HIGHCUT,
+                         'pulsemax': ef.PULSEMAX, 'usemark': False}
+
+
+def test_import_does_not_load_eegfeatures():
+    code = 'import sys, mentalserver; sys.exit("eegfeatures" in sys.modules or "scipy" in sys.modules)'
+    subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(ms.__file__)), check=True)
+
+
+def batching(predictor, window, size, count):
+    async def main():
+        with ThreadPoolExecutor(2) as pool:
+            batcher = ms.Batcher(predictor, pool, 2, window, size)
+            start = time.monotonic()
+            futures = [batcher.submit(x) for x in samples(count)]
+            done = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5)
+            return batcher, done, time.monotonic() - start
+    return asyncio.run(main())
+
+
+def test_batch_at_size_cap():
+    batcher, done, elapsed = batching(Predictor(), 10.0, 4, 8)
+    assert batcher.sizes == {4: 2}
+    assert done == classes(8)
+    assert elapsed < 5                                                  # Did not wait for the window
+
+
+def test_batch_timer_flush():
+    batcher, done, elapsed = batching(Predictor(), 0.05, 100, 3)
+    assert batcher.sizes == {3: 1}
+    assert done == classes(3)
+    assert elapsed >= 0.04
+    assert batcher.timer is None and not batcher.samples
+
+
+@pytest.mark.parametrize('predict, message', [(lambda x: 1 / 0, 'division by zero'),
+                                              (lambda x: ['Fatigued'], '1 results for 5 samples')])
+def test_batch_error_on_every_future(predict, message):
+    predictor = Predictor()
+    predictor.predict_batch = predict
+    batcher, done, elapsed = batching(predictor, 0.001, 100, 5)
+    assert len(done) == 5
+    assert all(isinstance(result, Exception) and message in str(result) for result in done)
+    assert not batcher.tasks
+
+
+def test_batch_rejects_bad_samples():
+    async def main():
+        with ThreadPoolExecutor(1) as pool:
+            batcher = ms.Batcher(Predictor(), pool, 1, 0.001, 100)
+            bad = batcher.submit(np.zeros(FEATURES + 2))
+            good = batcher.submit(samples(1)[0])
+            return await asyncio.gather(bad, good, return_exceptions=True), batcher.sizes
+    (bad, good), sizes = asyncio.run(main())
+    assert isinstance(bad, ValueError) and good == 'Not Fatigued'
+    assert sizes == {1: 1}